@@ -1,14 +1,19 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from store.admin import ProductAdmin
+from store.admin_mixins import ChangeListPerformanceMixin
 from store.models import Product
 from tags.models import TaggedItem
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import User
+from .serializers import attach_tags
 # Register your models here.
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ChangeListPerformanceMixin, BaseUserAdmin):
     add_fieldsets = (
         (
             None,
@@ -18,12 +23,56 @@ class UserAdmin(BaseUserAdmin):
             },
         ), )
 
+class LoadedTagSelect(AutocompleteSelect):
+    '''
+    Labels the selected tag with the one loaded along with the row, where
+    AutocompleteSelect would query it again for every row.
+    '''
+    tag = None
+
+    def optgroups(self, name, value, attr=None):
+        if self.tag is None or [str(v) for v in value] != [str(self.tag.pk)]:
+            return super().optgroups(name, value, attr)
+        options = [] if self.is_required else [self.create_option(name, '', '', False, 0)]
+        options.append(self.create_option(name, self.tag.pk, self.choices.field.label_from_instance(self.tag),
+                                          {str(self.tag.pk)}, len(options)))
+        return [(None, options, 0)]
+
+class TaggedItemFormSet(BaseGenericInlineFormSet):
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if form.instance.tag_id is not None:
+            form.fields['tag'].widget.widget.tag = form.instance.tag
+        return form
+
 class TagInLine(GenericTabularInline):
     model = TaggedItem
+    formset = TaggedItemFormSet
     autocomplete_fields = ['tag']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('tag')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'tag':
+            kwargs['widget'] = LoadedTagSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+class TaggedProductChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # One query for the tags of the whole page
+        attach_tags(self.result_list)
+
 class CustomProductAdmin(ProductAdmin):
     inlines = [TagInLine]
+    list_display = ProductAdmin.list_display + ['tags']
+
+    def get_changelist(self, request, **kwargs):
+        return TaggedProductChangeList
+
+    def tags(self, product):
+        return ', '.join(getattr(product, 'tag_labels', []))
 
 
 admin.site.unregister(Product)
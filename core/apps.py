@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .profiling import install_query_timing
+        from .serializers import register_product_tags
+        from . import signals
+        connection_created.connect(install_query_timing)
+        register_product_tags()
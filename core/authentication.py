@@ -0,0 +1,96 @@
+from functools import partial
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .versions import get_versions
+
+USER_KEY = 'core:user:{}'
+PERMISSIONS_KEY = 'core:permissions:{}'
+
+
+def get_timeout():
+    return getattr(settings, 'AUTH_CACHE_TIMEOUT', 60 * 5)
+
+
+def forget_users(*user_ids):
+    '''
+    Drops the cached users and permission sets, after the commit so a
+    request in between can't cache the old rows again.
+    '''
+    keys = [key.format(user_id) for user_id in set(user_ids) for key in (USER_KEY, PERMISSIONS_KEY)]
+    transaction.on_commit(partial(cache.delete_many, keys))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+    JWTAuthentication that loads the user from the cache instead of the
+    database. The core signals forget a user whenever it is saved or
+    deleted, which covers deactivation and password changes.
+
+    The whole row is cached except the fields in `secret_fields`, which
+    stay deferred. The password hash is one of them, the token revocation
+    check compares against a digest of it instead.
+    '''
+    secret_fields = ['password']
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        key = USER_KEY.format(user_id)
+        field_names = self.get_cached_field_names()
+        cached = cache.get(key)
+        if cached is None:
+            try:
+                row = self.user_model.objects \
+                    .values_list(*field_names, 'password') \
+                    .get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            cached = (row[:-1], get_md5_hash_password(row[-1]))
+            cache.set(key, cached, get_timeout())
+
+        values, password_digest = cached
+        user = self.user_model.from_db(self.user_model.objects.db, field_names, values)
+        # Checked on every request, cached or not
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+    def get_cached_field_names(self):
+        # In model order, which is how from_db() expects the values
+        return [field.attname for field in self.user_model._meta.concrete_fields
+                if field.name not in self.secret_fields]
+
+
+class CachedModelBackend(ModelBackend):
+    '''
+    ModelBackend that keeps every user's permission set in the cache.
+    Entries are stored with the Group version, which the core signals bump
+    when group memberships or group permissions change.
+    '''
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = PERMISSIONS_KEY.format(user_obj.pk)
+            version = get_versions(Group)[0]
+            cached = cache.get(key)
+            if cached is not None and cached[0] == version:
+                user_obj._perm_cache = cached[1]
+            else:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, (version, permissions), get_timeout())
+        return user_obj._perm_cache
@@ -0,0 +1,119 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+# Holds the unix time until which the client reads from the primary
+STICKY_COOKIE = 'primary_until'
+
+# The replica the current request reads from, None for the primary
+_read_database = ContextVar('read_database', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'REPLICA_DATABASES', []))
+
+
+@contextmanager
+def read_from(alias):
+    token = _read_database.set(alias)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+def in_transaction():
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def reads_from_replica():
+    '''
+    Whether reads in the current request go to a replica, which can lag
+    behind the primary and so behind the cache versions bumped on commit.
+    '''
+    return _read_database.get() is not None and not in_transaction()
+
+
+class ReplicaRouter:
+    '''
+    Sends reads to the replica chosen for the current request, see
+    ReplicaMiddleware, and everything else to the primary. Reads inside a
+    transaction stay on the primary so they see its own writes.
+    '''
+
+    def db_for_read(self, model, **hints):
+        if not reads_from_replica():
+            return DEFAULT_DB_ALIAS
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows, so objects read from any of them can be related
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    '''
+    Lets safe requests to views with `read_from_replica = True` read from a
+    random REPLICA_DATABASES alias. A client that just wrote something gets
+    a cookie that keeps its reads on the primary for
+    REPLICA_STICKY_SECONDS, long enough for the replicas to catch up.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _read_database.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        self.stick(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = _read_database.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        self.stick(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        if request.method not in SAFE_METHODS or not getattr(view, 'read_from_replica', False):
+            return
+        replicas = get_replicas()
+        if replicas and not self.is_sticky(request):
+            _read_database.set(random.choice(replicas))
+
+    def is_sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def stick(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not get_replicas():
+            return
+        seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        response.set_cookie(STICKY_COOKIE, str(int(time.time() + seconds)), max_age=seconds,
+                            httponly=True, samesite='Lax')
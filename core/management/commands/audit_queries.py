@@ -0,0 +1,194 @@
+import json
+import re
+from urllib.parse import parse_qsl
+from django.apps import apps
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework.request import Request
+from core.models import User
+from store.pagination import estimate_count
+from .bench_endpoints import URLCONFS, iter_patterns, sample_kwargs
+
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)')
+POSTGRESQL_SCAN = re.compile(r'Seq Scan on (\w+)')
+POSTGRESQL_SORT = re.compile(r'^\s*(?:->\s*)?Sort\b', re.MULTILINE)
+
+
+def find_scans(queryset):
+    '''
+    Returns the plan of the queryset, the tables it reads in full and
+    whether it sorts the rows itself instead of reading them in index
+    order. Backends we can't read plans for report no scans.
+    '''
+    connection = connections[queryset.db]
+    if connection.vendor == 'mysql':
+        plan = queryset.explain(format='json')
+        tables, sort = [], '"using_filesort": true' in plan
+        stack = [json.loads(plan)]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                if node.get('access_type') == 'ALL':
+                    tables.append(node['table_name'])
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        return plan, tables, sort
+
+    plan = queryset.explain()
+    if connection.vendor == 'sqlite':
+        tables, sort = SQLITE_SCAN.findall(plan), 'USE TEMP B-TREE FOR ORDER BY' in plan
+        if not sort and not queryset.query.where and queryset.query.high_mark is not None:
+            # Reading the table in rowid order stops at the LIMIT
+            tables = [table for table in tables if table != queryset.model._meta.db_table]
+        return plan, tables, sort
+    if connection.vendor == 'postgresql':
+        return plan, POSTGRESQL_SCAN.findall(plan), bool(POSTGRESQL_SORT.search(plan))
+    return plan, [], False
+
+
+class Command(BaseCommand):
+    help = ('Runs EXPLAIN on the queries behind every API list and detail route and every admin '
+            'changelist, with each of their filters and orderings, and flags full table scans.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Ignore scans of tables with fewer rows than this, reading them whole is fine.')
+        parser.add_argument('--user', help='Username to build the querysets for, defaults to the first superuser.')
+        parser.add_argument('--filter', help='Only audit queries whose name contains this string.')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error when a query scans.')
+
+    def handle(self, *args, **options):
+        self.user = self.get_user(options['user'])
+        self.factory = RequestFactory()
+        self.min_rows = options['min_rows']
+        self.table_sizes = {}
+        self.models = {model._meta.db_table: model for model in apps.get_models(include_auto_created=True)}
+
+        audited = 0
+        flagged = []
+        for name, queryset in [*self.get_api_querysets(), *self.get_admin_querysets()]:
+            if options['filter'] and options['filter'] not in name:
+                continue
+            plan, tables, sort = find_scans(queryset)
+            tables = sorted({table for table in tables if self.is_big(table)})
+            sort = sort and self.is_big(queryset.model._meta.db_table)
+            audited += 1
+
+            problems = [f'full scan of {table}' for table in tables] + (['sort'] if sort else [])
+            if problems:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(f'{name}: {", ".join(problems)}'))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {queryset.query}')
+                self.stdout.write('\n'.join(f'    {line}' for line in plan.splitlines()))
+
+        summary = f'{len(flagged)} of {audited} queries scan or sort tables with at least {self.min_rows} rows'
+        if flagged and options['fail']:
+            raise CommandError(summary)
+        self.stdout.write(summary)
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user = User.objects.filter(is_superuser=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('No superuser to build the querysets for, create one or pass --user.')
+        return user
+
+    def is_big(self, table):
+        if table not in self.table_sizes:
+            model = self.models.get(table)
+            self.table_sizes[table] = model is not None and \
+                estimate_count(model._default_manager.all(), self.min_rows) >= self.min_rows
+        return self.table_sizes[table]
+
+    def get_request(self, path, params=None):
+        request = self.factory.get(path, params or {})
+        request.user = self.user
+        return request
+
+    def get_api_querysets(self):
+        for label, root, urlconf in URLCONFS:
+            seen = set()
+            for _, pattern in iter_patterns(urlconf.urlpatterns):
+                actions = getattr(pattern.callback, 'actions', None) or {}
+                keywords = set(pattern.pattern.regex.groupindex)
+                if pattern.name in seen or 'format' in keywords or actions.get('get') not in ('list', 'retrieve'):
+                    continue
+                seen.add(pattern.name)
+                view_class = pattern.callback.cls
+                kwargs = sample_kwargs(view_class, keywords) if keywords else {}
+                if kwargs is None:
+                    self.stdout.write(self.style.WARNING(f'{label}:{pattern.name}: no rows to build the url from, skipped'))
+                    continue
+                path = root.rstrip('/') + reverse(pattern.name, urlconf=urlconf, kwargs=kwargs)
+                for params in self.get_api_variants(view_class, path, actions['get'], kwargs):
+                    query = '&'.join(f'{key}={value}' for key, value in params.items())
+                    name = f'{view_class.__name__}.{actions["get"]}' + (f' ?{query}' if query else '')
+                    view = view_class(request=Request(self.get_request(path, params)), action=actions['get'],
+                                      args=(), kwargs=kwargs, format_kwarg=None)
+                    view.request.user = self.user
+                    yield name, self.get_view_queryset(view)
+
+    def get_api_variants(self, view_class, path, action, kwargs):
+        yield {}
+        if action != 'list':
+            return
+        view = view_class(request=Request(self.get_request(path)), action=action,
+                          args=(), kwargs=kwargs, format_kwarg=None)
+        view.request.user = self.user
+        queryset = view.get_queryset()
+        filterset_class = getattr(view_class, 'filterset_class', None)
+        if filterset_class is not None:
+            for name, filter in filterset_class.base_filters.items():
+                # Filtering on a value the table actually holds
+                value = queryset.order_by().values_list(filter.field_name, flat=True).first()
+                if value is not None:
+                    yield {name: value}
+        for field in getattr(view_class, 'ordering_fields', None) or []:
+            if field != '__all__':
+                yield {'ordering': field}
+
+    def get_view_queryset(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        if view.action == 'retrieve':
+            lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+            return queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+        paginator = view.paginator
+        if hasattr(paginator, 'get_page_queryset'):
+            return paginator.get_page_queryset(queryset, view.request)
+        if paginator is not None and paginator.page_size:
+            return queryset[:paginator.page_size]
+        return queryset
+
+    def get_admin_querysets(self):
+        for model, model_admin in admin.site._registry.items():
+            path = f'/admin/{model._meta.app_label}/{model._meta.model_name}/'
+            name = f'{type(model_admin).__name__} changelist'
+            request = self.get_request(path)
+            changelist = model_admin.get_changelist_instance(request)
+            yield name, self.get_page(changelist)
+
+            variants = []
+            if model_admin.get_search_fields(request):
+                variants.append({'q': 'a'})
+            for spec in changelist.filter_specs:
+                # The first choice that isn't "All" or already selected
+                choice = next((choice for choice in spec.choices(changelist)
+                               if not choice['selected'] and choice['query_string'] != '?'), None)
+                if choice is not None:
+                    variants.append(dict(parse_qsl(choice['query_string'].lstrip('?'))))
+            for params in variants:
+                query = '&'.join(f'{key}={value}' for key, value in params.items())
+                yield f'{name} ?{query}', self.get_page(
+                    model_admin.get_changelist_instance(self.get_request(path, params))
+                )
+
+    def get_page(self, changelist):
+        return changelist.queryset[:changelist.list_per_page]
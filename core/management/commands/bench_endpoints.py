@@ -0,0 +1,222 @@
+import json
+import re
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import URLPattern, URLResolver, reverse
+from django.urls.resolvers import RoutePattern
+from djoser import urls as djoser_urls
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from core.models import User
+from core.profiling import QueryTimer
+from store import urls as store_urls
+
+# (label, prefix, urlconf module) for every API whose GET routes get benchmarked
+URLCONFS = [('store', '/store/', store_urls), ('auth', '/auth/', djoser_urls)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def iter_patterns(patterns, prefix=''):
+    '''
+    Yields (route, pattern) for every URLPattern. The full path() route
+    lets unnamed patterns, which can't be reversed, be filled in by hand;
+    it is None for regex patterns.
+    '''
+    for pattern in patterns:
+        route = None
+        if prefix is not None and isinstance(pattern.pattern, RoutePattern):
+            route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from iter_patterns(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route, pattern
+
+
+def fill_route(route, kwargs):
+    return re.sub(r'<(?:\w+:)?(\w+)>', lambda match: str(kwargs[match[1]]), route)
+
+
+def get_route_model(view_class):
+    '''
+    Works out which model a viewset serves, asking get_serializer_class()
+    for viewsets that pick their serializer per request.
+    '''
+    queryset = getattr(view_class, 'queryset', None)
+    if queryset is not None:
+        return queryset.model
+    view = view_class()
+    view.request = Request(APIRequestFactory().get('/'))
+    view.action = 'list'
+    view.format_kwarg = None
+    view.kwargs = {}
+    try:
+        return view.get_serializer_class().Meta.model
+    except (AssertionError, AttributeError):
+        return None
+
+
+def sample_kwargs(view_class, keywords):
+    '''
+    Builds url kwargs from the first row of the model the view serves, or
+    returns None when there is no row to point at.
+    '''
+    model = get_route_model(view_class) if view_class else None
+    sample = model._default_manager.order_by('pk').first() if model else None
+    if sample is None:
+        return None
+
+    kwargs = {}
+    for keyword in keywords:
+        if keyword.endswith('_pk'):
+            # Nested routes take the parent id from the sample row itself
+            kwargs[keyword] = getattr(sample, keyword[:-3] + '_id')
+        else:
+            kwargs[keyword] = getattr(sample, keyword, sample.pk)
+    return kwargs
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every GET route of the store and auth APIs against the current database '
+            'and optionally compares the results with a saved baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--user', help='Username to authenticate as, defaults to the first superuser.')
+        parser.add_argument('--anonymous', action='store_true', help='Send the requests unauthenticated.')
+        parser.add_argument('--filter', help='Only run routes whose name contains this string.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Compare with results previously written by --output.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 slowdown counted as a regression (default 0.2 = 20%%).')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore p95 slowdowns smaller than this, they are noise.')
+
+    def handle(self, *args, **options):
+        # An address outside INTERNAL_IPS keeps the debug toolbar out of the measurements
+        self.client = APIClient(SERVER_NAME='localhost', REMOTE_ADDR='192.0.2.1')
+        if not options['anonymous']:
+            self.client.force_authenticate(self.get_user(options['user']))
+
+        results = []
+        for name, url in self.get_routes(options['filter']):
+            result = self.run_route(name, url, options['warmup'], options['iterations'])
+            results.append(result)
+            self.stdout.write(
+                f'{name:<30} {result["status"]}  p50 {result["p50_ms"]:7.2f}ms  p95 {result["p95_ms"]:7.2f}ms  '
+                f'p99 {result["p99_ms"]:7.2f}ms  {result["rps"]:8.1f} req/s  '
+                f'{result["queries"]:3d} queries  {result["sql_ms"]:6.2f}ms sql'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({'iterations': options['iterations'], 'results': results}, file, indent=2)
+
+        if options['baseline']:
+            self.compare(results, options)
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user = User.objects.filter(is_superuser=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('No superuser to authenticate as, create one or pass --user / --anonymous.')
+        return user
+
+    def get_routes(self, name_filter):
+        for label, root, urlconf in URLCONFS:
+            seen = set()
+            for route, pattern in iter_patterns(urlconf.urlpatterns):
+                name = pattern.name or route
+                if name is None:
+                    self.stdout.write(self.style.WARNING(f'{label}: unnamed route {pattern.pattern}, skipped'))
+                    continue
+                # Nested routers each add their own api-root
+                if name in seen:
+                    continue
+                seen.add(name)
+                keywords = set(pattern.pattern.regex.groupindex)
+                callback = pattern.callback
+                actions = getattr(callback, 'actions', None)
+                if 'format' in keywords or (actions is not None and 'get' not in actions):
+                    continue
+                if name_filter and name_filter not in name:
+                    continue
+
+                kwargs = {}
+                if keywords:
+                    # The async catalog views record the viewset they mirror
+                    view_class = getattr(callback, 'cls', None) or getattr(callback, 'viewset_class', None)
+                    kwargs = sample_kwargs(view_class, keywords)
+                    if kwargs is None:
+                        self.stdout.write(self.style.WARNING(f'{name}: no rows to build the url from, skipped'))
+                        continue
+                if pattern.name:
+                    # Reversing within each urlconf keeps names like api-root from clashing
+                    path = reverse(pattern.name, urlconf=urlconf, kwargs=kwargs)
+                else:
+                    path = '/' + fill_route(route, kwargs)
+                yield f'{label}:{name}', root.rstrip('/') + path
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        if response.streaming:
+            # The exports only run their queries as the body is read
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def run_route(self, name, url, warmup, iterations):
+        for _ in range(warmup):
+            self.get(url)
+
+        latencies = []
+        query_counts = []
+        sql_times = []
+        status = None
+        started = time.perf_counter()
+        for _ in range(iterations):
+            # Timed by an execute wrapper, connection.queries only keeps times rounded to the millisecond
+            with QueryTimer().installed() as queries:
+                request_started = time.perf_counter()
+                response = self.get(url)
+                latencies.append(time.perf_counter() - request_started)
+            status = response.status_code
+            query_counts.append(queries.count)
+            sql_times.append(queries.duration)
+        elapsed = time.perf_counter() - started
+
+        return {
+            'name': name,
+            'url': url,
+            'status': status,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'rps': iterations / elapsed,
+            'queries': percentile(query_counts, 0.5),
+            'sql_ms': percentile(sql_times, 0.5) * 1000,
+        }
+
+    def compare(self, results, options):
+        with open(options['baseline']) as file:
+            baseline = {result['name']: result for result in json.load(file)['results']}
+
+        regressions = []
+        for result in results:
+            before = baseline.get(result['name'])
+            if before is None:
+                continue
+            slowdown = result['p95_ms'] - before['p95_ms']
+            if slowdown > options['min_delta_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + options['threshold']):
+                regressions.append(f'{result["name"]}: p95 {before["p95_ms"]:.2f}ms -> {result["p95_ms"]:.2f}ms')
+            if result['queries'] > before['queries']:
+                regressions.append(f'{result["name"]}: queries {before["queries"]} -> {result["queries"]}')
+
+        if regressions:
+            raise CommandError('Performance regressions against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from core.renderers import JSONRenderer, msgspec
+from store.fast_serializers import FastOrderSerializer, FastProductSerializer
+from store.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = ("Times rendering product and order payloads with DRF's JSONRenderer and with "
+            'core.renderers.JSONRenderer, through msgspec when it is installed and through its pure Python encoder.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Products in the product payload.')
+        parser.add_argument('--orders', type=int, default=1000, help='Orders in the order payload.')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        payloads = []
+        for name, model, serializer_class, count in [
+            ('products', Product, FastProductSerializer, options['products']),
+            ('orders', Order, FastOrderSerializer, options['orders']),
+        ]:
+            serializer = serializer_class()
+            data = serializer.serialize(serializer.values(model.objects.order_by('pk')[:count]))
+            if data:
+                payloads.append((f'{len(data)} {name}', data))
+        if not payloads:
+            raise CommandError('Nothing to render, run seed_data first.')
+
+        backends = [('DRF JSONRenderer', DRFJSONRenderer())]
+        pure = JSONRenderer()
+        pure.use_msgspec = False
+        backends.append(('JSONRenderer, pure Python', pure))
+        if msgspec is not None:
+            backends.append(('JSONRenderer, msgspec', JSONRenderer()))
+
+        for label, data in payloads:
+            self.stdout.write(label)
+            baseline = None
+            for name, renderer in backends:
+                times = []
+                for _ in range(options['rounds']):
+                    started = time.perf_counter()
+                    output = renderer.render(data)
+                    times.append(time.perf_counter() - started)
+                best = min(times)
+                baseline = baseline or best
+                self.stdout.write(f'  {name}: best of {options["rounds"]} {best * 1000:.1f}ms, '
+                                  f'{len(output) / 1024:.0f}KiB, {baseline / best:.1f}x')
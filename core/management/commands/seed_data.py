@@ -0,0 +1,318 @@
+import random
+import time
+import uuid
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from core.models import User
+from likes.models import LikedItem
+from store.models import Address, Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, Review
+from tags.models import Tag, TaggedItem
+
+ADJECTIVES = ['Classic', 'Organic', 'Smart', 'Vintage', 'Compact', 'Deluxe', 'Rustic', 'Wireless',
+              'Handmade', 'Ultra', 'Eco', 'Portable', 'Premium', 'Mini', 'Heavy Duty', 'Soft']
+NOUNS = ['Chair', 'Lamp', 'Backpack', 'Headphones', 'Mug', 'Jacket', 'Blender', 'Notebook',
+         'Sneakers', 'Watch', 'Tent', 'Keyboard', 'Bottle', 'Scarf', 'Speaker', 'Pan']
+WORDS = ['durable', 'lightweight', 'water', 'resistant', 'cotton', 'steel', 'comfortable', 'design',
+         'everyday', 'travel', 'kitchen', 'office', 'outdoor', 'gift', 'warranty', 'recycled']
+FIRST_NAMES = ['James', 'Mary', 'Ahmed', 'Sofia', 'Wei', 'Fatima', 'Lucas', 'Aiko', 'Omar', 'Emma',
+               'Ivan', 'Priya', 'Diego', 'Chloe', 'Kwame', 'Nora']
+LAST_NAMES = ['Smith', 'Garcia', 'Hassan', 'Chen', 'Ivanova', 'Kim', 'Okafor', 'Silva', 'Muller',
+              'Rossi', 'Patel', 'Nguyen', 'Cohen', 'Novak', 'Haddad', 'Tanaka']
+CITIES = ['Cairo', 'Toronto', 'Berlin', 'Lagos', 'Lima', 'Osaka', 'Austin', 'Lyon']
+
+
+class ZipfSampler:
+    '''
+    Draws from `items` with P(rank k) proportional to 1 / k**exponent,
+    so a handful of items get most of the traffic.
+    '''
+    def __init__(self, items, exponent, rng):
+        self.items = items
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / (rank ** exponent) for rank in range(1, len(items) + 1)))
+        self.total = self.cum_weights[-1]
+
+    def sample(self):
+        return self.items[bisect(self.cum_weights, self.rng.random() * self.total)]
+
+    def sample_distinct(self, count):
+        picked = {}
+        for _ in range(count * 3):
+            picked[self.sample()] = None
+            if len(picked) == count:
+                break
+        return list(picked)
+
+
+@contextmanager
+def explicit_dates(*fields):
+    '''
+    auto_now_add would stamp every seeded row with the same time, so it's
+    switched off while we insert rows with spread-out dates.
+    '''
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a large, realistic and reproducible dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=50)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--promotions', type=int, default=20)
+        parser.add_argument('--customers', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=5000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the product popularity distribution.')
+        parser.add_argument('--days', type=int, default=365, help='How far back orders, carts and reviews go.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+        with explicit_dates(Order._meta.get_field('placed_at'),
+                            Cart._meta.get_field('created_at'),
+                            Review._meta.get_field('date')):
+            self.step('collections', self.seed_collections)
+            self.step('promotions', self.seed_promotions)
+            self.step('products', self.seed_products)
+            self.step('customers', self.seed_customers)
+            self.step('orders', self.seed_orders)
+            self.step('carts', self.seed_carts)
+            self.step('reviews', self.seed_reviews)
+            self.step('tags', self.seed_tags)
+            self.step('likes', self.seed_likes)
+
+        self.reset_sequences()
+
+    def step(self, name, seed):
+        started = time.perf_counter()
+        count = seed()
+        self.stdout.write(f'{name}: {count} rows in {time.perf_counter() - started:.1f}s')
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def insert(self, model, rows):
+        '''
+        Bulk inserts an iterable of unsaved instances in chunks, so callers
+        can pass generators and never hold the whole table in memory.
+        '''
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.batch_size:
+                count += self.flush(model, chunk)
+                chunk = []
+        if chunk:
+            count += self.flush(model, chunk)
+        return count
+
+    def flush(self, model, chunk):
+        with transaction.atomic():
+            model.objects.bulk_create(chunk, batch_size=self.batch_size)
+        return len(chunk)
+
+    def past(self, days=None):
+        return self.now - timedelta(seconds=self.rng.random() * (days or self.options['days']) * 86400)
+
+    def seed_collections(self):
+        first_id = self.next_id(Collection)
+        self.collection_ids = list(range(first_id, first_id + self.options['collections']))
+        return self.insert(Collection, (
+            Collection(id=collection_id, title=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)}s {collection_id}')
+            for collection_id in self.collection_ids
+        ))
+
+    def seed_promotions(self):
+        first_id = self.next_id(Promotion)
+        self.promotion_ids = list(range(first_id, first_id + self.options['promotions']))
+        return self.insert(Promotion, (
+            Promotion(id=promotion_id, description=f'Promotion {promotion_id}',
+                      discount=self.rng.choice([0.05, 0.1, 0.15, 0.2, 0.25, 0.5]))
+            for promotion_id in self.promotion_ids
+        ))
+
+    def seed_products(self):
+        rng = self.rng
+        first_id = self.next_id(Product)
+        self.product_ids = list(range(first_id, first_id + self.options['products']))
+        # Shuffled so popularity isn't correlated with insertion order
+        popularity = self.product_ids[:]
+        rng.shuffle(popularity)
+        self.popular_products = ZipfSampler(popularity, self.options['zipf'], rng)
+        collections = ZipfSampler(self.collection_ids, 0.8, rng)
+        self.prices = {}
+
+        def products():
+            for product_id in self.product_ids:
+                # Log-normal prices: mostly cheap items with a long expensive tail
+                price = Decimal(min(max(rng.lognormvariate(3, 1), 1), 9999)).quantize(Decimal('0.01'))
+                self.prices[product_id] = price
+                title = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {product_id}'
+                yield Product(
+                    id=product_id, title=title, slug=title.lower().replace(' ', '-'),
+                    description=' '.join(rng.choices(WORDS, k=rng.randint(5, 30))),
+                    unit_price=price, inventory=rng.randint(0, 500), collection_id=collections.sample(),
+                )
+
+        # Product bulk inserts index themselves, chunk by chunk
+        count = self.insert(Product, products())
+
+        if self.promotion_ids:
+            Through = Product.promotions.through
+            self.insert(Through, (
+                Through(product_id=product_id, promotion_id=promotion_id)
+                for product_id in self.product_ids if rng.random() < 0.1
+                for promotion_id in rng.sample(self.promotion_ids, min(rng.randint(1, 2), len(self.promotion_ids)))
+            ))
+        return count
+
+    def seed_customers(self):
+        rng = self.rng
+        password = make_password('password')
+        first_user_id = self.next_id(User)
+        first_customer_id = self.next_id(Customer)
+        count = self.options['customers']
+        self.customer_ids = list(range(first_customer_id, first_customer_id + count))
+        self.user_ids = list(range(first_user_id, first_user_id + count))
+
+        self.insert(User, (
+            User(id=user_id, username=f'user{user_id}', email=f'user{user_id}@example.com', password=password,
+                 first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                 date_joined=self.past(self.options['days'] * 2))
+            for user_id in self.user_ids
+        ))
+        count = self.insert(Customer, (
+            Customer(id=customer_id, user_id=user_id, phone=f'+1{rng.randint(2000000000, 9999999999)}',
+                     membership=rng.choices('BSG', weights=[80, 15, 5])[0])
+            for customer_id, user_id in zip(self.customer_ids, self.user_ids)
+        ))
+        self.insert(Address, (
+            Address(customer_id=customer_id, street=f'{rng.randint(1, 999)} {rng.choice(LAST_NAMES)} St',
+                    city=rng.choice(CITIES))
+            for customer_id in self.customer_ids
+            for _ in range(rng.choice([1, 1, 1, 2]))
+        ))
+        return count
+
+    def seed_orders(self):
+        if not self.customer_ids or not self.product_ids:
+            return 0
+        rng = self.rng
+        # A few customers place most of the orders too
+        customers = ZipfSampler(self.customer_ids, 0.7, rng)
+        first_order_id = self.next_id(Order)
+        first_item_id = self.next_id(OrderItem)
+        total = self.options['orders']
+
+        count = 0
+        item_id = first_item_id
+        for start in range(0, total, self.batch_size):
+            orders = []
+            items = []
+            for order_id in range(first_order_id + start, first_order_id + min(start + self.batch_size, total)):
+                orders.append(Order(
+                    id=order_id, customer_id=customers.sample(), placed_at=self.past(),
+                    payment_status=rng.choices('CPF', weights=[85, 10, 5])[0],
+                ))
+                for product_id in self.popular_products.sample_distinct(min(int(rng.expovariate(0.6)) + 1, 10)):
+                    items.append(OrderItem(id=item_id, order_id=order_id, product_id=product_id,
+                                           unit_price=self.prices[product_id], quantity=rng.randint(1, 3)))
+                    item_id += 1
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+            count += len(orders)
+        return count
+
+    def seed_carts(self):
+        if not self.product_ids:
+            return 0
+        rng = self.rng
+        carts = [
+            Cart(id=uuid.UUID(int=rng.getrandbits(128), version=4), created_at=self.past(90))
+            for _ in range(self.options['carts'])
+        ]
+        count = self.insert(Cart, carts)
+        self.insert(CartItem, (
+            CartItem(cart_id=cart.id, product_id=product_id, quantity=rng.randint(1, 3))
+            for cart in carts
+            for product_id in self.popular_products.sample_distinct(rng.randint(0, 5))
+        ))
+        return count
+
+    def seed_reviews(self):
+        if not self.product_ids:
+            return 0
+        rng = self.rng
+        return self.insert(Review, (
+            Review(product_id=self.popular_products.sample(), name=rng.choice(FIRST_NAMES),
+                   description=' '.join(rng.choices(WORDS, k=rng.randint(3, 40))), date=self.past().date())
+            for _ in range(self.options['reviews'])
+        ))
+
+    def seed_tags(self):
+        rng = self.rng
+        first_id = self.next_id(Tag)
+        tag_ids = list(range(first_id, first_id + self.options['tags']))
+        count = self.insert(Tag, (Tag(id=tag_id, label=f'{rng.choice(WORDS)}-{tag_id}') for tag_id in tag_ids))
+        if tag_ids:
+            content_type = ContentType.objects.get_for_model(Product)
+            self.insert(TaggedItem, (
+                TaggedItem(tag_id=tag_id, content_type=content_type, object_id=product_id)
+                for product_id in self.product_ids
+                for tag_id in rng.sample(tag_ids, min(rng.randint(0, 4), len(tag_ids)))
+            ))
+        return count
+
+    def seed_likes(self):
+        if not self.user_ids or not self.product_ids:
+            return 0
+        rng = self.rng
+        content_type = ContentType.objects.get_for_model(Product)
+        users = ZipfSampler(self.user_ids, 0.7, rng)
+        seen = set()
+
+        def likes():
+            for _ in range(self.options['likes']):
+                like = (users.sample(), self.popular_products.sample())
+                if like not in seen:
+                    seen.add(like)
+                    yield LikedItem(user_id=like[0], content_type=content_type, object_id=like[1])
+
+        return self.insert(LikedItem, likes())
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL sequences behind; other backends track them on insert
+        statements = connection.ops.sequence_reset_sql(no_style(), [
+            Collection, Promotion, Product, User, Customer, Order, OrderItem, Tag,
+        ])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,238 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .profiling import QueryTimer
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    __slots__ = ('count', 'duration', 'buckets', 'queries', 'query_duration', 'response_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # One slot per bucket plus the last one for everything above BUCKETS[-1]
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.queries = 0
+        self.query_duration = 0.0
+        self.response_bytes = 0
+
+    def observe(self, duration, queries, query_duration, response_bytes):
+        self.count += 1
+        self.duration += duration
+        self.buckets[bisect_left(BUCKETS, duration)] += 1
+        self.queries += queries
+        self.query_duration += query_duration
+        self.response_bytes += response_bytes
+
+    def merge(self, other):
+        self.count += other.count
+        self.duration += other.duration
+        self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+        self.queries += other.queries
+        self.query_duration += other.query_duration
+        self.response_bytes += other.response_bytes
+
+    def to_list(self):
+        return [self.count, self.duration, self.buckets, self.queries, self.query_duration, self.response_bytes]
+
+    @classmethod
+    def from_list(cls, values):
+        metric = cls()
+        (metric.count, metric.duration, metric.buckets,
+         metric.queries, metric.query_duration, metric.response_bytes) = values
+        return metric
+
+
+class MetricsRegistry:
+    '''
+    Request metrics keyed by (view, method, status).
+
+    Every thread records into its own shard so recording never takes a
+    lock; shards are only merged when the metrics are read. With a
+    directory set, each process periodically writes its totals to
+    metrics-<pid>.json there and collect() adds up the files of all
+    the processes sharing it.
+    '''
+
+    def __init__(self, directory=None, flush_interval=10):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def get_shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = {}
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def record(self, labels, duration, queries, query_duration, response_bytes):
+        shard = self.get_shard()
+        metric = shard.get(labels)
+        if metric is None:
+            metric = shard[labels] = Metric()
+        metric.observe(duration, queries, query_duration, response_bytes)
+
+        if self.directory and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.last_flush = time.monotonic()
+            self.flush()
+
+    def snapshot(self):
+        merged = {}
+        for shard in list(self.shards):
+            for labels, metric in list(shard.items()):
+                merged.setdefault(labels, Metric()).merge(metric)
+        return merged
+
+    def get_path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        data = [[*labels, metric.to_list()] for labels, metric in self.snapshot().items()]
+        # Written to a temporary file and renamed so readers never see half a file
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(path, self.get_path(os.getpid()))
+
+    def collect(self):
+        merged = self.snapshot()
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+
+        own_path = self.get_path(os.getpid())
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # This process is already counted from memory, which is fresher than its file
+            if not (name.startswith('metrics-') and name.endswith('.json')) or path == own_path:
+                continue
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for *labels, values in data:
+                merged.setdefault(tuple(labels), Metric()).merge(Metric.from_list(values))
+        return merged
+
+
+registry = MetricsRegistry(
+    directory=getattr(settings, 'METRICS_DIR', None),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 10),
+)
+if registry.directory:
+    atexit.register(registry.flush)
+
+
+def get_view_name(view_func, method):
+    '''
+    Names DRF views after their class and action, like ProductViewSet.list,
+    and plain Django views after their dotted path.
+    '''
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method.lower(), method.lower())}'
+
+
+def get_response_bytes(response):
+    if response.streaming:
+        return 0
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with QueryTimer().installed() as queries:
+            response = self.get_response(request)
+        self.record(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with QueryTimer().installed() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, started, queries)
+        return response
+
+    def record(self, request, response, started, queries):
+        view = getattr(request, '_metrics_view', 'unresolved')
+        registry.record(
+            (view, request.method, str(response.status_code)),
+            time.perf_counter() - started, queries.count, queries.duration, get_response_bytes(response),
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = get_view_name(view_func, request.method)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(metrics):
+    '''
+    Formats collected metrics in the Prometheus text exposition format.
+    '''
+    families = [
+        ('storefront_http_requests_total', 'counter', 'Requests handled.',
+         lambda metric: metric.count),
+        ('storefront_db_queries_total', 'counter', 'SQL queries run while handling requests.',
+         lambda metric: metric.queries),
+        ('storefront_db_query_duration_seconds_total', 'counter', 'Time spent running SQL queries.',
+         lambda metric: metric.query_duration),
+        ('storefront_http_response_size_bytes_total', 'counter', 'Bytes sent in response bodies.',
+         lambda metric: metric.response_bytes),
+    ]
+    items = sorted(metrics.items())
+    lines = []
+    for name, kind, description, value in families:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, metric in items:
+            lines.append(f'{name}{{{format_labels(labels)}}} {value(metric)}')
+
+    name = 'storefront_http_request_duration_seconds'
+    lines.append(f'# HELP {name} Request latency.')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, metric in items:
+        label_text = format_labels(labels)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, metric.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {metric.count}')
+        lines.append(f'{name}_sum{{{label_text}}} {metric.duration}')
+        lines.append(f'{name}_count{{{label_text}}} {metric.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    view, method, status = labels
+    return f'view="{escape_label(view)}",method="{escape_label(method)}",status="{escape_label(status)}"'
@@ -5,4 +5,11 @@ from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
+
+    class Meta:
+        # Customer admin searches and sorts by name
+        indexes = [
+            models.Index(fields=['first_name', 'last_name']),
+            models.Index(fields=['last_name']),
+        ]
     
\ No newline at end of file
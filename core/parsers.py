@@ -0,0 +1,36 @@
+import codecs
+from decimal import Decimal
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import json
+from .renderers import JSONRenderer, msgspec
+
+if msgspec is not None:
+    msgspec_decoder = msgspec.json.Decoder(float_hook=Decimal)
+    DECODE_ERRORS = (ValueError, msgspec.DecodeError)
+else:
+    DECODE_ERRORS = (ValueError,)
+
+
+class JSONParser(parsers.JSONParser):
+    '''
+    DRF's JSONParser reading numbers with a fraction or exponent as Decimal,
+    so prices posted by clients reach the DecimalFields without a detour
+    through float. msgspec does the decoding when it is installed, for
+    UTF-8 bodies and strict JSON since it always rejects NaN and Infinity.
+    '''
+    renderer_class = JSONRenderer
+    use_msgspec = True
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parsers.get_encoding(parser_context)
+
+        try:
+            if self.use_msgspec and msgspec is not None and self.strict and codecs.lookup(encoding).name == 'utf-8':
+                return msgspec_decoder.decode(stream.read())
+            decoded_stream = codecs.getreader(encoding)(stream)
+            parse_constant = json.strict_constant if self.strict else None
+            return json.load(decoded_stream, parse_float=Decimal, parse_constant=parse_constant)
+        except DECODE_ERRORS as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,204 @@
+import cProfile
+import hmac
+import itertools
+import marshal
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+PROFILE_HEADER = 'X-Profile'
+
+# Profiles live in memory, so every worker process keeps its own buffer
+profiles = deque(maxlen=getattr(settings, 'PROFILING_BUFFER_SIZE', 50))
+_profile_ids = itertools.count(1)
+# Only one request is profiled at a time, the others that get sampled meanwhile only record timings
+_profiler_lock = threading.Lock()
+_query_timers = ContextVar('query_timers', default=())
+
+
+def get_profile(profile_id):
+    for profile in list(profiles):
+        if profile['id'] == profile_id:
+            return profile
+    return None
+
+
+def time_queries(execute, sql, params, many, context):
+    timers = _query_timers.get()
+    if not timers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for timer in timers:
+            timer.count += 1
+            timer.duration += duration
+
+
+def install_query_timing(connection, **kwargs):
+    '''
+    Adds time_queries() to a connection, connected to connection_created.
+    It goes first in execute_wrappers because execute_wrapper() blocks
+    remove the last entry when they exit.
+    '''
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_queries)
+
+
+class QueryTimer:
+    '''
+    Counts the queries run in the current context while it is installed and
+    the time they took. The timers travel in a context variable, so queries
+    the async ORM runs on another thread's connection are counted too.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    @contextmanager
+    def installed(self):
+        for connection in connections.all():
+            install_query_timing(connection)
+        token = _query_timers.set(_query_timers.get() + (self,))
+        try:
+            yield self
+        finally:
+            _query_timers.reset(token)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.render_started = None
+        self.render_finished = None
+        self.queries = QueryTimer()
+
+    def rendered(self, response):
+        self.render_finished = time.perf_counter()
+
+    def as_dict(self, finished):
+        view_started = self.view_started or self.started
+        view_finished = self.render_started or finished
+        render = (self.render_finished or view_finished) - view_finished
+        return {
+            'db': self.queries.duration * 1000,
+            'view': max(view_finished - view_started - self.queries.duration, 0) * 1000,
+            'render': render * 1000,
+            'total': (finished - self.started) * 1000,
+        }
+
+    def server_timing(self, finished):
+        timings = self.as_dict(finished)
+        descriptions = {
+            'db': f'{self.queries.count} queries',
+            'view': 'view and serialization',
+            'render': 'rendering',
+            'total': 'total',
+        }
+        return ', '.join(
+            f'{name};dur={duration:.2f};desc="{descriptions[name]}"'
+            for name, duration in timings.items()
+        )
+
+
+class ProfilingMiddleware:
+    '''
+    Profiles a random PROFILING_SAMPLE_RATE fraction of requests, plus the
+    ones sending PROFILING_HEADER_TOKEN in the X-Profile header. Those
+    requests get a Server-Timing header with the time spent in the database,
+    the view and rendering, and their cProfile stats go to a ring buffer of
+    PROFILING_BUFFER_SIZE entries that staff can download from
+    /admin/profiles/. Requests that are not sampled only pay for a
+    random() call.
+
+    Under ASGI the event loop runs many requests at once, so async requests
+    only get the timings and no cProfile stats.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.token = getattr(settings, 'PROFILING_HEADER_TOKEN', None)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        timings = request._profiling_timings = RequestTimings()
+        profiler = cProfile.Profile() if _profiler_lock.acquire(blocking=False) else None
+        try:
+            with timings.queries.installed():
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            if profiler:
+                _profiler_lock.release()
+
+        finished = time.perf_counter()
+        response['Server-Timing'] = timings.server_timing(finished)
+        if profiler:
+            profile_id = next(_profile_ids)
+            profiler.create_stats()
+            profiles.append({
+                'id': profile_id,
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'timestamp': time.time(),
+                'queries': timings.queries.count,
+                'timings': timings.as_dict(finished),
+                'stats': marshal.dumps(profiler.stats),
+            })
+            response['X-Profile-Id'] = str(profile_id)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        timings = request._profiling_timings = RequestTimings()
+        with timings.queries.installed():
+            response = await self.get_response(request)
+        response['Server-Timing'] = timings.server_timing(time.perf_counter())
+        return response
+
+    def should_profile(self, request):
+        if self.token:
+            token = request.headers.get(PROFILE_HEADER)
+            if token and hmac.compare_digest(token, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = getattr(request, '_profiling_timings', None)
+        if timings:
+            timings.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook runs, which splits view time from render time
+        timings = getattr(request, '_profiling_timings', None)
+        if timings:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(timings.rendered)
+        return response
@@ -1,4 +1,8 @@
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
+from rest_framework import serializers
+from store.models import Product
+from store.serializers import ProductSerializer
+from tags.models import Tag, TaggedItem
 
 class UserCreateSerializer(BaseUserCreateSerializer):
 
@@ -7,4 +11,23 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+def attach_tags(products):
+    '''
+    Sets `tag_labels` on every product, fetching the tags of all of them in
+    one query.
+    '''
+    tags = TaggedItem.objects.get_tags_for_many(Product, [product.pk for product in products])
+    for product in products:
+        product.tag_labels = [tag.label for tag in tags.get(product.pk, [])]
+
+
+def register_product_tags():
+    # /store/products/?include=tags
+    ProductSerializer.register_optional_field(
+        'tags',
+        lambda: serializers.ListField(source='tag_labels', child=serializers.CharField(), read_only=True),
+        attach_tags,
+        models=[Tag, TaggedItem],
+    )
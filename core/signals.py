@@ -0,0 +1,43 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from tags.models import Tag, TaggedItem
+from .authentication import forget_users
+from .models import User
+from .versions import bump_version
+
+
+# Products rendered with ?include=tags are cached under the tag versions too
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=TaggedItem)
+def bump_tag_version(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_saved_user(sender, instance, **kwargs):
+    forget_users(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def forget_user_permissions(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Changed from the group or permission side, which can touch any number of users
+        bump_version(Group)
+    else:
+        forget_users(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def bump_group_permissions_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version(Group)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def bump_deleted_permissions_version(sender, **kwargs):
+    bump_version(Group)
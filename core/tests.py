@@ -1,3 +1,491 @@
-from django.test import TestCase
+import json
+import marshal
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from threading import Thread
+from unittest.mock import patch
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from store.cache import stats
+from likes.models import LikeCounter, LikedItem
+from store.models import Collection, Customer, Product
+from tags.models import Tag, TaggedItem
+from . import metrics, parsers, profiling, renderers
+from .authentication import USER_KEY, CachedJWTAuthentication
+from .db import STICKY_COOKIE, ReplicaMiddleware, read_from
+from .models import User
 
 # Create your tests here.
+
+
+class UserAdminQueryCountTests(TestCase):
+    def test_changelist_runs_a_fixed_number_of_queries(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        User.objects.bulk_create([
+            User(username=f'user-{i}', email=f'user-{i}@example.com') for i in range(50)
+        ])
+        # session, user, group filter choices, count and rows
+        with self.assertNumQueries(5):
+            response = self.client.get('/admin/core/user/')
+        self.assertEqual(response.status_code, 200)
+
+
+class ProductTagsTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug=f'product-{i}', unit_price=Decimal('1.99'),
+                    inventory=100, collection=collection)
+            for i in range(10)
+        ])
+        tags = [Tag.objects.create(label=label) for label in ['b', 'a']]
+        TaggedItem.objects.bulk_create([
+            TaggedItem(tag=tag, content_object=product) for product in self.products for tag in tags
+        ])
+        ContentType.objects.get_for_model(Product)
+
+    def test_tags_are_only_included_on_request(self):
+        response = self.client.get('/store/products/')
+        self.assertNotIn('tags', response.data['results'][0])
+
+    def test_product_list_fetches_tags_in_one_query(self):
+        # products, then the tags of the whole page
+        with self.assertNumQueries(2):
+            response = self.client.get('/store/products/', {'include': 'tags'})
+        self.assertEqual([product['tags'] for product in response.data['results']], [['a', 'b']] * 10)
+
+    def test_tagging_changes_the_etag(self):
+        response = self.client.get(f'/store/products/{self.products[0].id}/', {'include': 'tags'})
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.create(tag=Tag.objects.create(label='c'), content_object=self.products[0])
+        response = self.client.get(f'/store/products/{self.products[0].id}/', {'include': 'tags'},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], ['a', 'b', 'c'])
+
+    def test_product_change_page_runs_a_fixed_number_of_queries(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        product = self.products[0]
+        TaggedItem.objects.bulk_create([
+            TaggedItem(tag=Tag.objects.create(label=f'tag-{i}'), content_object=product) for i in range(10)
+        ])
+        # session, user, product, tagged items with their tags, and the collection choice
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/admin/store/product/{product.id}/change/')
+        self.assertContains(response, '<option value="{}" selected>tag-9</option>'.format(
+            Tag.objects.get(label='tag-9').id), html=True)
+
+    def test_get_tags_for_objects(self):
+        tags = TaggedItem.objects.get_tags_for_objects([(Product, [self.products[0].id]), (Collection, [1])])
+        self.assertEqual(list(tags), [(Product, self.products[0].id)])
+        self.assertEqual([tag.label for tag in tags[(Product, self.products[0].id)]], ['a', 'b'])
+
+
+class AuditQueriesTests(TestCase):
+    def test_indexed_filters_and_orderings_do_not_scan(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.create(title='Product', slug='product', unit_price=Decimal('1.99'),
+                               inventory=100, collection=collection)
+        output = StringIO()
+        call_command('audit_queries', '--min-rows', '0', '--filter', 'ProductViewSet.list', stdout=output)
+        lines = output.getvalue().splitlines()
+        for name in ['?ordering=unit_price', '?ordering=last_update']:
+            self.assertIn(f'ProductViewSet.list {name}: ok', lines)
+        # The matching rows still get sorted by title, but they are found through the index
+        self.assertIn('ProductViewSet.list ?unit_price__gt=1.99: sort', lines)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', '--collections', '3', '--products', '30', '--promotions', '2', '--customers', '5',
+                     '--orders', '20', '--carts', '3', '--reviews', '10', '--tags', '4', '--likes', '40',
+                     '--batch-size', '7', stdout=StringIO())
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_data_keeps_counters_and_search_index_in_step(self):
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(sum(Collection.objects.values_list('products_count', flat=True)), 30)
+        self.assertEqual(sum(LikeCounter.objects.values_list('count', flat=True)), LikedItem.objects.count())
+        product = Product.objects.order_by('-pk').first()
+        response = self.client.get('/store/products/', {'search': product.title})
+        self.assertIn(product.id, [result['id'] for result in response.data['results']])
+
+    # The benchmark client poses as localhost, which DEBUG = False doesn't allow by default
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_bench_endpoints_runs_every_get_route(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('bench_endpoints', '--iterations', '1', '--warmup', '0', '--output', output,
+                         stdout=StringIO())
+            with open(output) as file:
+                results = {result['name']: result['status'] for result in json.load(file)['results']}
+        for name in ['store:products-detail', 'store:async/products/<int:product_pk>/reviews/<int:pk>/',
+                     'store:export/orders/', 'auth:user-me']:
+            self.assertIn(name, results)
+        self.assertEqual({name: status for name, status in results.items() if status != 200}, {})
+
+
+def replica_view(request):
+    return HttpResponse(router.db_for_read(Product))
+
+replica_view.read_from_replica = True
+
+
+def primary_view(request):
+    return HttpResponse(router.db_for_read(Product))
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaMiddlewareTests(SimpleTestCase):
+    def run_view(self, view, method='get', cookies=None, status=200):
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            response = view(request)
+            response.status_code = status
+            return response
+
+        middleware = ReplicaMiddleware(get_response)
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return middleware(request)
+
+    def test_safe_requests_to_marked_views_read_from_a_replica(self):
+        self.assertEqual(self.run_view(replica_view).content, b'replica')
+        self.assertEqual(self.run_view(primary_view).content, b'default')
+        self.assertEqual(self.run_view(replica_view, 'post').content, b'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_writes_stick_to_the_primary(self):
+        response = self.run_view(primary_view, 'post')
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertEqual(self.run_view(replica_view, cookies={STICKY_COOKIE: cookie.value}).content, b'default')
+        self.assertEqual(self.run_view(replica_view, cookies={STICKY_COOKIE: str(int(time.time()) - 1)}).content, b'replica')
+        self.assertEqual(self.run_view(replica_view, cookies={STICKY_COOKIE: 'garbage'}).content, b'replica')
+
+    def test_failed_writes_do_not_stick(self):
+        response = self.run_view(primary_view, 'post', status=400)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_nothing_changes_without_replicas(self):
+        response = self.run_view(replica_view, 'post')
+        self.assertEqual(response.content, b'default')
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    def test_writes_and_transactions_use_the_primary(self):
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+
+# A second SQLite file standing in for a replica. Added here rather than in
+# DATABASES, so the suite runs on any primary without extra configuration.
+SQLITE_REPLICA = 'sqlite_replica'
+connections.settings[SQLITE_REPLICA] = connections.configure_settings({
+    DEFAULT_DB_ALIAS: {},
+    SQLITE_REPLICA: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), f'storefront-replica-{os.getpid()}.sqlite3')},
+    },
+})[SQLITE_REPLICA]
+
+
+@override_settings(REPLICA_DATABASES=[SQLITE_REPLICA])
+class SQLiteReplicaTests(TransactionTestCase):
+    '''
+    The replica holds other rows than the primary, so each response shows
+    which database it was read from.
+    '''
+    databases = {DEFAULT_DB_ALIAS, SQLITE_REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        for alias in [DEFAULT_DB_ALIAS, SQLITE_REPLICA]:
+            collection = Collection.objects.using(alias).create(title=alias)
+            Product.objects.using(alias).create(title=f'On {alias}', slug=alias, unit_price=Decimal('1.99'),
+                                                inventory=1, collection=collection)
+
+    def titles(self, response):
+        return [product['title'] for product in response.data['results']]
+
+    def test_reads_come_from_the_replica_until_the_client_writes(self):
+        client = APIClient()
+        # Authenticated requests skip the response cache
+        client.force_authenticate(User.objects.create(username='customer', email='customer@example.com'))
+        response = client.get('/store/products/')
+        self.assertEqual(self.titles(response), [f'On {SQLITE_REPLICA}'])
+        self.assertNotIn('ETag', response)
+
+        self.assertEqual(client.post('/store/carts/').status_code, 201)
+        response = client.get('/store/products/')
+        self.assertEqual(self.titles(response), ['On default'])
+        self.assertIn('ETag', response)
+
+    def test_anonymous_reads_are_cached_from_the_primary(self):
+        client = APIClient()
+        responses = [client.get('/store/products/') for _ in range(5)]
+        self.assertEqual([response['X-Cache'] for response in responses], ['MISS'] + ['HIT'] * 4)
+        self.assertEqual({tuple(self.titles(response)) for response in responses}, {('On default',)})
+        self.assertEqual(stats(), {'hits': 4, 'misses': 1})
+        response = client.get('/store/products/', HTTP_IF_NONE_MATCH=responses[0]['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiling.profiles.clear()
+        Collection.objects.create(title='Collection')
+
+    @override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_HEADER_TOKEN='secret')
+    def test_only_sampled_requests_are_profiled(self):
+        for headers in [{}, {'HTTP_X_PROFILE': 'wrong'}]:
+            response = self.client.get('/store/collections/', **headers)
+            self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(profiling.profiles), 0)
+
+        cache.clear()
+        response = self.client.get('/store/collections/', HTTP_X_PROFILE='secret')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        profile = profiling.get_profile(int(response['X-Profile-Id']))
+        self.assertEqual((profile['path'], profile['status'], profile['queries']), ('/store/collections/', 200, 1))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_the_buffer_keeps_the_latest_profiles(self):
+        with patch.object(profiling, 'profiles', deque(maxlen=3)):
+            ids = [int(self.client.get('/store/collections/')['X-Profile-Id']) for _ in range(5)]
+            self.assertEqual([profile['id'] for profile in profiling.profiles], ids[2:])
+            self.assertIsNone(profiling.get_profile(ids[0]))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_profiles_are_for_staff_only(self):
+        profile_id = self.client.get('/store/collections/')['X-Profile-Id']
+        urls = ['/admin/profiles/', f'/admin/profiles/{profile_id}/']
+        self.client.force_login(User.objects.create_user('customer', 'customer@example.com', 'password'))
+        for url in urls:
+            self.assertRedirects(self.client.get(url), f'/admin/login/?next={url}')
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        listed = self.client.get(urls[0]).json()['profiles']
+        self.assertIn(int(profile_id), [profile['id'] for profile in listed])
+        response = self.client.get(urls[1])
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertIsInstance(marshal.loads(response.content), dict)
+        self.assertEqual(self.client.get('/admin/profiles/0/').status_code, 404)
+
+
+class MetricsTests(TestCase):
+    def record(self, registry, labels=('ProductViewSet.list', 'GET', '200'), duration=0.02):
+        registry.record(labels, duration, 2, 0.001, 100)
+
+    def test_thread_shards_are_merged(self):
+        registry = metrics.MetricsRegistry()
+        self.record(registry, duration=0.003)
+        threads = [Thread(target=self.record, args=(registry,)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.record(registry, ('ProductViewSet.list', 'GET', '404'))
+
+        self.assertEqual(len(registry.shards), 4)
+        merged = registry.snapshot()
+        metric = merged[('ProductViewSet.list', 'GET', '200')]
+        self.assertEqual((metric.count, metric.queries, metric.response_bytes), (4, 8, 400))
+        self.assertAlmostEqual(metric.duration, 0.063)
+        self.assertEqual(metric.buckets[:3], [1, 0, 3])
+        self.assertEqual(merged[('ProductViewSet.list', 'GET', '404')].count, 1)
+
+    def test_other_processes_are_added_from_their_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = metrics.MetricsRegistry(directory)
+            self.record(other)
+            other.flush()
+            # As if another worker had written it
+            os.rename(other.get_path(os.getpid()), other.get_path(0))
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as file:
+                file.write('{half a fi')
+
+            registry = metrics.MetricsRegistry(directory)
+            self.record(registry)
+            registry.flush()
+            self.record(registry)
+            # Its own file is stale, the shards in memory count instead
+            self.assertEqual(registry.collect()[('ProductViewSet.list', 'GET', '200')].count, 3)
+
+    def test_export_is_for_internal_ips_and_staff(self):
+        self.client.get('/store/collections/')
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE storefront_http_requests_total counter', lines)
+        self.assertTrue(any(line.startswith(
+            'storefront_http_request_duration_seconds_bucket{view="CollectionViewSet.list",method="GET",status="200",le="+Inf"} '
+        ) for line in lines))
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_prometheus_format(self):
+        registry = metrics.MetricsRegistry()
+        self.record(registry, ('Say "hi"', 'GET', '200'))
+        lines = metrics.render_prometheus(registry.snapshot()).splitlines()
+        self.assertIn('storefront_db_queries_total{view="Say \\"hi\\"",method="GET",status="200"} 2', lines)
+        self.assertIn('storefront_http_request_duration_seconds_bucket{view="Say \\"hi\\"",method="GET",status="200",le="0.01"} 0', lines)
+        self.assertIn('storefront_http_request_duration_seconds_bucket{view="Say \\"hi\\"",method="GET",status="200",le="0.025"} 1', lines)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='customer', email='customer@example.com')
+        self.customer = Customer.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def test_cached_user_and_customer_skip_their_queries(self):
+        self.client.get('/store/orders/')
+        # Only the orders themselves
+        with self.assertNumQueries(1):
+            response = self.client.get('/store/orders/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_saving_the_user_forgets_it(self):
+        self.client.get('/store/orders/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/store/orders/').status_code, 401)
+
+    def test_password_hashes_are_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('secret-password')
+            self.user.save()
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        self.client.get('/store/orders/')
+        cached = cache.get(USER_KEY.format(self.user.pk))
+        self.assertNotIn(self.user.password, repr(cached))
+
+        with self.assertNumQueries(0):
+            user = CachedJWTAuthentication().get_user(token)
+            self.assertEqual((user.pk, user.is_active, user.email), (self.user.pk, True, 'customer@example.com'))
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+
+    def test_current_user_endpoint_runs_no_queries_once_cached(self):
+        # Like plain JWTAuthentication the first time, the user row and nothing per field
+        with self.assertNumQueries(1):
+            self.client.get('/auth/users/me/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/auth/users/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'customer@example.com')
+
+    def test_permissions_are_cached_until_they_change(self):
+        permission = Permission.objects.get(codename='view_history')
+        url = f'/store/customers/{self.customer.id}/history/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.add(permission)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.remove(permission)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_group_permission_changes_apply_to_members(self):
+        group = Group.objects.create(name='support')
+        self.user.groups.add(group)
+        url = f'/store/customers/{self.customer.id}/history/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(Permission.objects.get(codename='view_history'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class JSONRendererTests(SimpleTestCase):
+    data = {
+        'id': 1,
+        'title': 'Caf\u00e9 \u2028\u2029 "quoted"',
+        'ratio': 0.1,
+        'active': True,
+        'missing': None,
+        'cart': uuid.UUID('2022eeb1-a57f-4699-96ac-bf4ad4a0ae23'),
+        'placed_at': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+        'day': date(2024, 1, 2),
+        'error': ErrorDetail('Not found', code='not_found'),
+        'label': gettext_lazy('Pending'),
+        'items': [1, [], {}, (2, 3), {'nested': [{'deep': 'value'}]}],
+        7: 'int key',
+    }
+
+    def backends(self):
+        return [False, True] if renderers.msgspec is not None else [False]
+
+    def render(self, data, media_type=None, use_msgspec=False):
+        renderer = renderers.JSONRenderer()
+        renderer.use_msgspec = use_msgspec
+        return renderer.render(data, media_type)
+
+    def test_renders_like_drf_without_decimals(self):
+        for use_msgspec in self.backends():
+            for media_type in [None, 'application/json; indent=2']:
+                with self.subTest(msgspec=use_msgspec, media_type=media_type):
+                    self.assertEqual(
+                        self.render(self.data, media_type, use_msgspec),
+                        DRFJSONRenderer().render(self.data, media_type),
+                    )
+
+    def test_decimals_are_rendered_exactly(self):
+        for use_msgspec in self.backends():
+            with self.subTest(msgspec=use_msgspec):
+                self.assertEqual(
+                    self.render({'price': Decimal('12.50'), 'taxed': Decimal('13.750000000000000177')}, None, use_msgspec),
+                    b'{"price":12.50,"taxed":13.750000000000000177}',
+                )
+
+    def test_parser_reads_fractions_as_decimals(self):
+        for use_msgspec in self.backends():
+            with self.subTest(msgspec=use_msgspec):
+                parser = parsers.JSONParser()
+                parser.use_msgspec = use_msgspec
+                data = parser.parse(BytesIO(b'{"unit_price": 10.10, "inventory": 3}'))
+                self.assertEqual(data, {'unit_price': Decimal('10.10'), 'inventory': 3})
+                self.assertEqual(str(data['unit_price']), '10.10')
+                with self.assertRaises(ParseError):
+                    parser.parse(BytesIO(b'{"unit_price": NaN}'))
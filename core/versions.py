@@ -0,0 +1,83 @@
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+
+# Name prefix -> seconds after which an unused version may expire, see register_timeout()
+_timeouts = {}
+
+
+def label(model):
+    return model._meta.label_lower
+
+
+def register_timeout(prefix, timeout):
+    '''
+    Lets the versions of names starting with `prefix` expire after
+    `timeout` seconds instead of being kept forever, for names that stop
+    mattering, like those of single objects that get deleted.
+    '''
+    _timeouts[prefix] = timeout
+
+
+def get_timeout(name):
+    for prefix, timeout in _timeouts.items():
+        if name.startswith(prefix):
+            return timeout
+    return None
+
+
+def incr(key, initial, timeout=None):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key was never set or got evicted
+        cache.add(key, initial, timeout)
+        return cache.get(key)
+
+
+def get_named_versions(names):
+    '''
+    Returns the versions of the names in one cache round trip, initialising
+    missing keys. Versions start from the current time in milliseconds so a
+    key that got evicted never comes back with a value it already had.
+    '''
+    now = time.time_ns() // 1_000_000
+    keys = [VERSION_KEY.format(name) for name in names]
+    values = cache.get_many(keys)
+    for key, name in zip(keys, names):
+        if key not in values:
+            cache.add(key, now, get_timeout(name))
+            values[key] = cache.get(key, now)
+    return [values[key] for key in keys]
+
+
+def bump_named_versions(names):
+    # A reader between the bump and the commit would tie the new version to the old data
+    transaction.on_commit(partial(_bump, names))
+
+
+def _bump(names):
+    now = time.time_ns() // 1_000_000
+    for name in names:
+        incr(VERSION_KEY.format(name), now, get_timeout(name))
+
+
+def forget_named_versions(names):
+    '''
+    Drops versions in one round trip instead of bumping each. A dropped
+    version comes back initialised from the current time, so anything
+    cached under the old one still stops matching.
+    '''
+    transaction.on_commit(partial(cache.delete_many, [VERSION_KEY.format(name) for name in names]))
+
+
+def get_versions(*models):
+    return get_named_versions([label(model) for model in models])
+
+
+def bump_version(*models):
+    bump_named_versions([label(model) for model in models])
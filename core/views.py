@@ -1,3 +1,36 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from .metrics import registry, render_prometheus
+from .profiling import get_profile, profiles
 
-# Create your views here.
+
+def metrics(request):
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(registry.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def profile_list(request):
+    return JsonResponse({
+        'profiles': [
+            {
+                **{key: value for key, value in profile.items() if key != 'stats'},
+                'download': request.build_absolute_uri(f'{profile["id"]}/'),
+            }
+            for profile in reversed(list(profiles))
+        ]
+    })
+
+
+def profile_download(request, profile_id):
+    '''
+    Returns the profile in the pstats format, open it with
+    `python -m pstats profile-<id>.prof` or a viewer like snakeviz.
+    '''
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise Http404('No such profile, it may have been pushed out of the buffer.')
+    response = HttpResponse(profile['stats'], content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.prof"'
+    return response
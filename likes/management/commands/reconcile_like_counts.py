@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, F, OuterRef
+from likes.models import LikeCounter, LikedItem, count_likes
+
+
+class Command(BaseCommand):
+    help = 'Recomputes LikeCounter.count wherever it drifted from the real number of likes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted counters.')
+
+    def handle(self, *args, **options):
+        missing = LikedItem.objects \
+            .exclude(Exists(LikeCounter.objects.filter(content_type=OuterRef('content_type'), object_id=OuterRef('object_id')))) \
+            .values_list('content_type', 'object_id') \
+            .distinct()
+        missing = list(missing)
+        self.stdout.write(f'{len(missing)} liked objects have no counter')
+        if missing and not options['dry_run']:
+            LikeCounter.objects.bulk_create([
+                LikeCounter(content_type_id=content_type_id, object_id=object_id)
+                for content_type_id, object_id in missing
+            ], ignore_conflicts=True)
+
+        drifted = LikeCounter.objects \
+            .annotate(actual_count=count_likes()) \
+            .exclude(count=F('actual_count')) \
+            .values_list('id', 'content_type__app_label', 'content_type__model', 'object_id', 'count', 'actual_count')
+
+        fixed = 0
+        for (counter_id, app_label, model, object_id, stored, actual) in drifted:
+            self.stdout.write(f'{app_label}.{model} #{object_id}: stored {stored}, actual {actual}')
+            if not options['dry_run']:
+                # Recount inside the UPDATE so likes added meanwhile aren't lost
+                LikeCounter.objects.filter(pk=counter_id).update(count=count_likes())
+                fixed += 1
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted)} counters have drifted')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{fixed} counters were reconciled'))
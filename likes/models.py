@@ -1,11 +1,159 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 
+class LikedItemQuerySet(models.QuerySet):
+    '''
+    Keeps LikeCounter in step with bulk inserts, which don't send the
+    signals the per-object path relies on.
+    '''
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False, update_conflicts=False, **kwargs):
+        if update_conflicts:
+            # An update can move a like to another object, leaving the old one counted
+            raise ValueError('LikedItem.objects.bulk_create() does not support update_conflicts.')
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, batch_size, ignore_conflicts, **kwargs)
+            deltas = defaultdict(Counter)
+            for obj in objs:
+                deltas[obj.content_type_id][obj.object_id] += 1
+            for content_type_id, object_deltas in deltas.items():
+                if ignore_conflicts:
+                    # The skipped duplicates are still in objs, so count what made it in
+                    LikeCounter.objects.recount(content_type_id, object_deltas)
+                else:
+                    LikeCounter.objects.adjust(content_type_id, object_deltas)
+        return objs
+
+    def like(self, user, obj):
+        '''
+        Returns True if the like was added, False if the user already liked
+        the object. The unique constraint settles concurrent likes.
+        '''
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(user=user, content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk)
+        except IntegrityError:
+            return False
+        return True
+
+    def unlike(self, user, obj):
+        '''
+        Returns True if a like was removed. The row is locked first so that
+        of two concurrent unlikes only one decrements the counter.
+        '''
+        with transaction.atomic(using=self.db):
+            item = self.select_for_update().filter(
+                user=user, content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk
+            ).first()
+            if item is None:
+                return False
+            item.delete()
+        return True
+
+    def toggle(self, user, obj):
+        '''
+        Flips the like and returns whether the object ends up liked.
+        '''
+        if self.unlike(user, obj):
+            return False
+        self.like(user, obj)
+        return True
+
+
 class LikedItem(models.Model):
+    objects = LikedItemQuerySet.as_manager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='likes_unique_like'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+
+
+def count_likes():
+    # The number of likes of the counter's object, computed by the database
+    return Coalesce(Subquery(
+        LikedItem.objects
+            .filter(content_type=OuterRef('content_type'), object_id=OuterRef('object_id'))
+            .order_by()
+            .values('content_type')
+            .annotate(likes=Count('*'))
+            .values('likes')[:1]
+    ), Value(0))
+
+
+class LikeCounterQuerySet(models.QuerySet):
+    def adjust(self, content_type, deltas):
+        '''
+        Applies {object_id: delta} to the counters of one content type,
+        creating the missing ones. Counters never go below zero.
+        '''
+        content_type_id = getattr(content_type, 'pk', content_type)
+        by_delta = defaultdict(list)
+        for object_id, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(object_id)
+        if not by_delta:
+            return
+
+        with transaction.atomic(using=self.db):
+            # Creating the rows first, whoever wins the race, leaves a plain UPDATE to do
+            self.bulk_create([
+                LikeCounter(content_type_id=content_type_id, object_id=object_id)
+                for delta, object_ids in by_delta.items() if delta > 0
+                for object_id in object_ids
+            ], ignore_conflicts=True)
+            for delta, object_ids in by_delta.items():
+                self.filter(content_type_id=content_type_id, object_id__in=object_ids) \
+                    .update(count=Greatest(F('count') + delta, Value(0)))
+
+    def recount(self, content_type, object_ids):
+        '''
+        Sets the counters of the objects to their actual number of likes,
+        creating the missing ones.
+        '''
+        content_type_id = getattr(content_type, 'pk', content_type)
+        object_ids = list(object_ids)
+        with transaction.atomic(using=self.db):
+            self.bulk_create([
+                LikeCounter(content_type_id=content_type_id, object_id=object_id) for object_id in object_ids
+            ], ignore_conflicts=True)
+            self.filter(content_type_id=content_type_id, object_id__in=object_ids).update(count=count_likes())
+
+    def for_model(self, model):
+        return self.filter(content_type=ContentType.objects.get_for_model(model))
+
+    def top(self, model, limit):
+        # Walks likes_counter_top_idx, so it reads `limit` rows however many objects are liked
+        return self.for_model(model).filter(count__gt=0).order_by('-count', 'object_id')[:limit]
+
+
+class LikeCounter(models.Model):
+    '''
+    How many likes an object has, maintained as likes come and go. The
+    reconcile_like_counts command fixes any drift.
+    '''
+    objects = LikeCounterQuerySet.as_manager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='likes_unique_counter'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', '-count', 'object_id'], name='likes_counter_top_idx'),
+        ]
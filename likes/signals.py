@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import LikeCounter, LikedItem
+
+
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        LikeCounter.objects.adjust(instance.content_type_id, {instance.object_id: 1})
+
+
+@receiver(post_delete, sender=LikedItem)
+def count_unlike(sender, instance, **kwargs):
+    LikeCounter.objects.adjust(instance.content_type_id, {instance.object_id: -1})
@@ -1,3 +1,106 @@
+from decimal import Decimal
+from io import StringIO
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework.test import APIClient
+from core.models import User
+from store.models import Collection, Product
+from .models import LikeCounter, LikedItem
 
 # Create your tests here.
+
+
+class LikeTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug=f'product-{i}', unit_price=Decimal('1.99'),
+                    inventory=100, collection=collection)
+            for i in range(5)
+        ])
+        self.users = [User.objects.create(username=f'user-{i}', email=f'user-{i}@example.com') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_count(self, product):
+        return LikeCounter.objects.for_model(Product).filter(object_id=product.pk).values_list('count', flat=True).first()
+
+    def test_like_and_unlike_are_idempotent(self):
+        product = self.products[0]
+        self.assertTrue(LikedItem.objects.like(self.users[0], product))
+        self.assertFalse(LikedItem.objects.like(self.users[0], product))
+        LikedItem.objects.like(self.users[1], product)
+        self.assertEqual(self.get_count(product), 2)
+
+        self.assertTrue(LikedItem.objects.unlike(self.users[0], product))
+        self.assertFalse(LikedItem.objects.unlike(self.users[0], product))
+        self.assertEqual(self.get_count(product), 1)
+
+    def test_toggle(self):
+        product = self.products[0]
+        self.assertTrue(LikedItem.objects.toggle(self.users[0], product))
+        self.assertFalse(LikedItem.objects.toggle(self.users[0], product))
+        self.assertEqual(self.get_count(product), 0)
+
+    def test_bulk_create_counts_likes(self):
+        content_type = ContentType.objects.get_for_model(Product)
+        LikedItem.objects.bulk_create([
+            LikedItem(user=user, content_type=content_type, object_id=product.pk)
+            for user in self.users for product in self.products[:2]
+        ] + [LikedItem(user=self.users[0], content_type=content_type, object_id=self.products[2].pk)])
+        self.assertEqual([self.get_count(product) for product in self.products[:4]], [3, 3, 1, None])
+
+    def test_bulk_create_ignoring_conflicts_counts_only_new_likes(self):
+        content_type = ContentType.objects.get_for_model(Product)
+        LikedItem.objects.like(self.users[0], self.products[0])
+        LikedItem.objects.bulk_create([
+            LikedItem(user=user, content_type=content_type, object_id=self.products[0].pk) for user in self.users
+        ] + [LikedItem(user=self.users[0], content_type=content_type, object_id=self.products[1].pk)] * 2,
+            ignore_conflicts=True)
+        self.assertEqual([self.get_count(product) for product in self.products[:2]], [3, 1])
+
+    def test_bulk_create_rejects_update_conflicts(self):
+        content_type = ContentType.objects.get_for_model(Product)
+        with self.assertRaises(ValueError):
+            LikedItem.objects.bulk_create(
+                [LikedItem(user=self.users[0], content_type=content_type, object_id=self.products[0].pk)],
+                update_conflicts=True, unique_fields=['user', 'content_type', 'object_id'], update_fields=['object_id'])
+        self.assertFalse(LikedItem.objects.exists())
+
+    def test_deleting_the_user_uncounts_their_likes(self):
+        LikedItem.objects.like(self.users[0], self.products[0])
+        self.users[0].delete()
+        self.assertEqual(self.get_count(self.products[0]), 0)
+
+    def test_like_endpoint(self):
+        url = f'/likes/store.product/{self.products[0].pk}/'
+        for method, expected in [('put', True), ('put', True), ('post', False), ('post', True), ('delete', False)]:
+            response = getattr(self.client, method)(url)
+            self.assertEqual(response.data, {'liked': expected, 'count': int(expected)})
+        self.assertEqual(self.client.get(url).data, {'liked': False, 'count': 0})
+
+    def test_like_endpoint_rejects_unknown_models_and_objects(self):
+        self.assertEqual(self.client.put(f'/likes/core.user/{self.users[0].pk}/').status_code, 404)
+        self.assertEqual(self.client.put('/likes/store.product/999/').status_code, 404)
+        self.assertEqual(APIClient().put(f'/likes/store.product/{self.products[0].pk}/').status_code, 401)
+
+    def test_top_liked(self):
+        for likes, product in zip([1, 3, 2], self.products):
+            for user in self.users[:likes]:
+                LikedItem.objects.like(user, product)
+        ContentType.objects.get_for_model(Product)
+        # counters, then the products
+        with self.assertNumQueries(2):
+            response = self.client.get('/likes/store.product/top/', {'limit': 2})
+        self.assertEqual([(item['object_id'], item['count']) for item in response.data],
+                         [(self.products[1].pk, 3), (self.products[2].pk, 2)])
+        self.assertEqual(response.data[0]['object']['title'], self.products[1].title)
+
+    def test_reconcile_like_counts(self):
+        LikedItem.objects.like(self.users[0], self.products[0])
+        LikedItem.objects.like(self.users[1], self.products[0])
+        LikeCounter.objects.update(count=5)
+        LikedItem.objects.filter(object_id=self.products[0].pk).update(object_id=self.products[1].pk)
+        call_command('reconcile_like_counts', stdout=StringIO())
+        self.assertEqual([self.get_count(product) for product in self.products[:2]], [0, 2])
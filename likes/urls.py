@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+# Models are addressed by their label, like /likes/store.product/1/
+urlpatterns = [
+    path('<str:label>/top/', views.TopLikedView.as_view()),
+    path('<str:label>/<int:object_id>/', views.LikeView.as_view()),
+]
@@ -1,3 +1,91 @@
-from django.shortcuts import render
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.shortcuts import get_object_or_404
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import LikeCounter, LikedItem
 
-# Create your views here.
+TOP_LIMIT = 10
+MAX_TOP_LIMIT = 100
+
+
+def get_likeable_model(label):
+    # Only the models listed in LIKES_MODELS can be liked through the API
+    if label not in settings.LIKES_MODELS:
+        raise NotFound(f'{label} cannot be liked.')
+    return apps.get_model(label)
+
+
+class LikeView(APIView):
+    '''
+    GET tells how many likes an object has and whether the user likes it,
+    PUT likes it, DELETE unlikes it and POST flips it. PUT and DELETE can be
+    repeated safely, and every method answers with the resulting state.
+    '''
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_object(self, label, object_id):
+        model = get_likeable_model(label)
+        return get_object_or_404(model._default_manager.only('pk'), pk=object_id)
+
+    def get_state(self, request, obj, liked=None):
+        if liked is None:
+            liked = request.user.is_authenticated and LikedItem.objects.filter(
+                user=request.user, content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk
+            ).exists()
+        count = LikeCounter.objects.for_model(type(obj)).filter(object_id=obj.pk) \
+            .values_list('count', flat=True).first()
+        return Response({'liked': liked, 'count': count or 0})
+
+    def get(self, request, label, object_id):
+        return self.get_state(request, self.get_object(label, object_id))
+
+    def put(self, request, label, object_id):
+        obj = self.get_object(label, object_id)
+        LikedItem.objects.like(request.user, obj)
+        return self.get_state(request, obj, liked=True)
+
+    def delete(self, request, label, object_id):
+        obj = self.get_object(label, object_id)
+        LikedItem.objects.unlike(request.user, obj)
+        return self.get_state(request, obj, liked=False)
+
+    def post(self, request, label, object_id):
+        obj = self.get_object(label, object_id)
+        return self.get_state(request, obj, liked=LikedItem.objects.toggle(request.user, obj))
+
+
+class TopLikedView(APIView):
+    '''
+    The ?limit= most liked objects of a model with their like counts, and
+    the objects themselves serialized when LIKES_MODELS names a serializer.
+    '''
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', TOP_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'A whole number is required.'})
+        if not 1 <= limit <= MAX_TOP_LIMIT:
+            raise ValidationError({'limit': f'Must be between 1 and {MAX_TOP_LIMIT}.'})
+        return limit
+
+    def get(self, request, label):
+        model = get_likeable_model(label)
+        counters = list(LikeCounter.objects.top(model, self.get_limit(request)))
+        results = [{'object_id': counter.object_id, 'count': counter.count} for counter in counters]
+
+        serializer_class = settings.LIKES_MODELS[label]
+        if serializer_class:
+            objects = model._default_manager.in_bulk([counter.object_id for counter in counters])
+            # Objects deleted since they were liked are left out
+            results = [result for result in results if result['object_id'] in objects]
+            data = import_string(serializer_class)(
+                [objects[result['object_id']] for result in results], many=True, context={'request': request}
+            ).data
+            for result, item in zip(results, data):
+                result['object'] = item
+        return Response(results)
@@ -1,9 +1,9 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
 from django.urls import reverse
 from django.utils.html import format_html, urlencode
 
 from . import models
+from .admin_mixins import ChangeListPerformanceMixin
 # Register your models here.
 
 
@@ -22,7 +22,7 @@ class InventoryFilter(admin.SimpleListFilter):
             return queryset.filter(inventory__lt = 10)
     
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ChangeListPerformanceMixin, admin.ModelAdmin):
     autocomplete_fields = ['collection']
     prepopulated_fields = {
         'slug' : ['title']
@@ -54,10 +54,10 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(ChangeListPerformanceMixin, admin.ModelAdmin):
     list_display = ["first_name", "last_name", "membership"]
     list_editable = ["membership"]
-    search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    search_fields = ['user__first_name__istartswith', 'user__last_name__istartswith']
     list_select_related = ['user']
     ordering = ["user__first_name", "user__last_name"]
     list_per_page = 10
@@ -71,24 +71,19 @@ class OrderItemInline(admin.StackedInline):
     max_num = 10
 
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ChangeListPerformanceMixin, admin.ModelAdmin):
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline]
     list_display = ["id", "placed_at", "customer"]
 
 @admin.register(models.Collection)
-class CollectionAdmin(admin.ModelAdmin):
+class CollectionAdmin(ChangeListPerformanceMixin, admin.ModelAdmin):
     list_display = ['title', 'product_count']
     search_fields = ['title']
-    @admin.display(ordering = "product_count")
+    @admin.display(ordering = "products_count")
     def product_count(self, collection):
         url = reverse("admin:store_product_changelist") + "?" + urlencode({'collection__id' : str(collection.id)})
-        return format_html("<a href ='{}'> {} </a>", url, collection.product_count)
-    
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            product_count = Count('products')
-        )
+        return format_html("<a href ='{}'> {} </a>", url, collection.products_count)
 
 # admin.site.register(models.Collection)
 # admin.site.register(models.Product, ProductAdmin)
\ No newline at end of file
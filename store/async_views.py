@@ -0,0 +1,129 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .views import ProductViewSet, CollectionViewSet, ReviewViewSet
+
+# Read-only async counterparts of the catalog viewsets for ASGI deployments.
+# Each view borrows its viewset's queryset, filters, pagination and
+# serializer so both paths return the same responses; only the database
+# access goes through the async ORM.
+
+
+def get_view(viewset_class, request, action, **kwargs):
+    return viewset_class(
+        request=Request(request), action=action, args=(), kwargs=kwargs, format_kwarg=None
+    )
+
+
+def render(data, status=200):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type += f'; charset={renderer.charset}'
+    return HttpResponse(renderer.render(data), status=status, content_type=content_type)
+
+
+def async_api_view(viewset_class):
+    '''
+    Turns API errors into responses and rejects anything but reads.
+    `viewset_class` is the viewset the view mirrors, kept on the view for
+    tools that need its model, like bench_endpoints.
+    '''
+    def decorator(function):
+        @wraps(function)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+            try:
+                return await function(request, *args, **kwargs)
+            except APIException as exc:
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return render(data, status=exc.status_code)
+        # Like the viewsets they mirror, these only read the catalog
+        wrapper.read_from_replica = True
+        wrapper.viewset_class = viewset_class
+        return wrapper
+    return decorator
+
+
+async def get_object(view, queryset):
+    try:
+        return await queryset.aget(pk=view.kwargs['pk'])
+    except (queryset.model.DoesNotExist, ValueError):
+        raise NotFound(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+async def serialize(view, instance, many=False):
+    serializer = view.get_serializer(instance, many=many)
+    # Fields added with ?include= prefetch through the sync ORM
+    if view.request.query_params.get('include'):
+        return await sync_to_async(lambda: serializer.data)()
+    return serializer.data
+
+
+async def list_objects(view):
+    # FilterSet validation can hit the database (ModelChoiceFilter), so it runs in a thread
+    queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+    fast = view.get_fast_serializer() if hasattr(view, 'get_fast_serializer') else None
+    if fast is not None:
+        return await list_values(view, fast, fast.values(queryset))
+    if view.paginator is None:
+        instances = [instance async for instance in queryset]
+        return render(await serialize(view, instances, many=True))
+
+    page = await view.paginator.apaginate_queryset(queryset, view.request, view)
+    return render(view.paginator.get_paginated_response(await serialize(view, page, many=True)).data)
+
+
+async def list_values(view, serializer, queryset):
+    if view.paginator is None:
+        rows = [row async for row in queryset]
+    else:
+        rows = await view.paginator.apaginate_queryset(queryset, view.request, view)
+    # Nested lists are read with the sync ORM
+    if serializer.get_plan().queries:
+        data = await sync_to_async(serializer.serialize)(rows)
+    else:
+        data = serializer.serialize(rows)
+    if view.paginator is None:
+        return render(data)
+    return render(view.paginator.get_paginated_response(data).data)
+
+
+@async_api_view(ProductViewSet)
+async def product_list(request):
+    return await list_objects(get_view(ProductViewSet, request, 'list'))
+
+
+@async_api_view(ProductViewSet)
+async def product_detail(request, pk):
+    view = get_view(ProductViewSet, request, 'retrieve', pk=pk)
+    product = await get_object(view, view.get_queryset())
+    return render(await serialize(view, product))
+
+
+@async_api_view(CollectionViewSet)
+async def collection_list(request):
+    return await list_objects(get_view(CollectionViewSet, request, 'list'))
+
+
+@async_api_view(CollectionViewSet)
+async def collection_detail(request, pk):
+    view = get_view(CollectionViewSet, request, 'retrieve', pk=pk)
+    collection = await get_object(view, view.get_queryset())
+    return render(await serialize(view, collection))
+
+
+@async_api_view(ReviewViewSet)
+async def review_list(request, product_pk):
+    return await list_objects(get_view(ReviewViewSet, request, 'list', product_pk=product_pk))
+
+
+@async_api_view(ReviewViewSet)
+async def review_detail(request, product_pk, pk):
+    view = get_view(ReviewViewSet, request, 'retrieve', product_pk=product_pk, pk=pk)
+    review = await get_object(view, view.get_queryset())
+    return render(await serialize(view, review))
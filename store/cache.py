@@ -0,0 +1,145 @@
+import hashlib
+from functools import partial
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+from core.db import read_from, reads_from_replica
+from core.versions import (
+    bump_named_versions, forget_named_versions, get_named_versions, incr, label, register_timeout,
+)
+
+# Cart versions are only needed while someone still looks at the cart
+CART_VERSION_PREFIX = 'store.cart:'
+CART_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+RESPONSE_KEY = 'store:response:{}:{}:{}'
+CUSTOMER_ID_KEY = 'store:customer_id:{}'
+CUSTOMER_ID_TIMEOUT = 60 * 60 * 24
+HITS_KEY = 'store:cache:hits'
+MISSES_KEY = 'store:cache:misses'
+
+register_timeout(CART_VERSION_PREFIX, CART_VERSION_TIMEOUT)
+
+
+def cart_version_name(cart_id):
+    try:
+        # The same cart can be addressed with or without dashes
+        cart_id = UUID(str(cart_id))
+    except ValueError:
+        pass
+    return f'{CART_VERSION_PREFIX}{cart_id}'
+
+
+def bump_cart_version(*cart_ids):
+    bump_named_versions([cart_version_name(cart_id) for cart_id in set(cart_ids)])
+
+
+def forget_cart_versions(*cart_ids):
+    # Deleted carts don't need a new version, just no longer the old one
+    forget_named_versions([cart_version_name(cart_id) for cart_id in set(cart_ids)])
+
+
+def forget_customer_ids(*user_ids):
+    # After the commit, or a reader could cache the old mapping again before the change is visible
+    keys = [CUSTOMER_ID_KEY.format(user_id) for user_id in set(user_ids)]
+    transaction.on_commit(partial(cache.delete_many, keys))
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+class ConditionalGetMixin:
+    '''
+    conditional_response() adds a strong ETag to a response, derived from
+    the cache versions of `cache_models` and of anything else
+    get_version_names() returns. A request whose If-None-Match still matches
+    gets a 304 after one cache round trip, without touching the database or
+    the serializer.
+
+    Responses read from a replica get no ETag, the replica may not have
+    caught up with the versions yet. There is deliberately no
+    Last-Modified: it only has one second of resolution, so a change in the
+    same second as a fetch would keep If-Modified-Since matching and the
+    client on the stale body.
+    '''
+    cache_models = ()
+
+    def get_cache_models(self):
+        return list(self.cache_models)
+
+    def get_version_names(self):
+        return [label(model) for model in self.get_cache_models()]
+
+    def get_request_digest(self, request):
+        query = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        return hashlib.md5(repr((request.path, query, request.accepted_media_type)).encode()).hexdigest()
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        versions = get_named_versions(self.get_version_names())
+        self.versions = '.'.join(str(version) for version in versions)
+        etag = '"{}"'.format(hashlib.md5(f'{self.get_request_digest(request)}:{self.versions}'.encode()).hexdigest())
+
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = self.get_full_response(handler, request, *args, **kwargs)
+        if response.status_code in (200, 304) and not getattr(response, 'read_from_replica', False):
+            response['ETag'] = etag
+        return response
+
+    def get_full_response(self, handler, request, *args, **kwargs):
+        response = handler(request, *args, **kwargs)
+        response.read_from_replica = reads_from_replica()
+        return response
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    '''
+    Caches anonymous list and retrieve responses. The cache key holds the
+    version of every model in `cache_models`, so saving or deleting any of
+    them makes the old entries unreachable instead of deleting them.
+
+    Misses are read from the primary even when the request was sent to a
+    replica: a lagging replica would file stale data under a version that
+    is already newer. Each version of a page costs the primary one read,
+    and every other request is a hit or a 304.
+    '''
+    cache_timeout = getattr(settings, 'STORE_RESPONSE_CACHE_TIMEOUT', 60 * 15)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        return RESPONSE_KEY.format(self.basename, self.versions, self.get_request_digest(request))
+
+    def get_full_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get_full_response(handler, request, *args, **kwargs)
+
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            incr(HITS_KEY, 1)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        incr(MISSES_KEY, 1)
+        with read_from(None):
+            response = super().get_full_response(handler, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
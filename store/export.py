@@ -0,0 +1,157 @@
+import csv
+import json
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Order, OrderItem, Product
+
+CHUNK_SIZE = 2000
+
+# (column, lookup) pairs, one row per order item
+ORDER_FIELDS = [
+    ('order_id', 'order_id'),
+    ('placed_at', 'order__placed_at'),
+    ('payment_status', 'order__payment_status'),
+    ('customer_id', 'order__customer_id'),
+    ('item_id', 'id'),
+    ('product_id', 'product_id'),
+    ('product_title', 'product__title'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+]
+
+PRODUCT_FIELDS = [
+    ('id', 'id'),
+    ('title', 'title'),
+    ('slug', 'slug'),
+    ('unit_price', 'unit_price'),
+    ('inventory', 'inventory'),
+    ('collection_id', 'collection_id'),
+    ('collection_title', 'collection__title'),
+    ('last_update', 'last_update'),
+]
+
+OUTPUTS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_bound(value, name):
+    '''
+    Accepts an ISO 8601 date or datetime, a bare date meaning midnight in
+    the current time zone.
+    '''
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError
+            parsed = datetime.combine(day, time.min)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 date or datetime.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_orders(since, until, status):
+    queryset = OrderItem.objects.all()
+    if since:
+        queryset = queryset.filter(order__placed_at__gte=since)
+    if until:
+        queryset = queryset.filter(order__placed_at__lt=until)
+    if status:
+        if status not in dict(Order.PAYMENT_STATUS_CHOICES):
+            raise ValueError(f'status must be one of {", ".join(dict(Order.PAYMENT_STATUS_CHOICES))}.')
+        queryset = queryset.filter(order__payment_status=status)
+    return queryset, ORDER_FIELDS
+
+
+def get_products(since, until, status):
+    if status:
+        raise ValueError('status only applies to orders.')
+    queryset = Product.objects.all()
+    if since:
+        queryset = queryset.filter(last_update__gte=since)
+    if until:
+        queryset = queryset.filter(last_update__lt=until)
+    return queryset, PRODUCT_FIELDS
+
+
+EXPORTS = {
+    'orders': get_orders,
+    'products': get_products,
+}
+
+
+def iter_chunks(queryset, lookups, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the rows as lists of value tuples in primary key order.
+
+    Each chunk is a separate `pk > last` query rather than one iterator():
+    the MySQL drivers buffer the whole result set client-side, so only
+    keyset chunks keep memory flat on every backend.
+    '''
+    queryset = queryset.order_by('pk').values_list('pk', *lookups)
+    last = None
+    while True:
+        rows = list((queryset if last is None else queryset.filter(pk__gt=last))[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [row[1:] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+def format_row(row):
+    return [
+        value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, Decimal) else value
+        for value in row
+    ]
+
+
+class Echo:
+    # csv.writer only needs write(), returning the line lets us yield it
+    def write(self, value):
+        return value
+
+
+def render_csv(columns, chunks):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for rows in chunks:
+        yield ''.join(writer.writerow(format_row(row)) for row in rows)
+
+
+def render_ndjson(columns, chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(columns, format_row(row))), separators=(',', ':')) + '\n' for row in rows)
+
+
+RENDERERS = {
+    'ndjson': render_ndjson,
+    'csv': render_csv,
+}
+
+
+def export(kind, output='ndjson', since=None, until=None, status=None, chunk_size=CHUNK_SIZE):
+    '''
+    Validates the arguments up front and returns (content_type, iterator of
+    str), the iterator running the queries lazily chunk by chunk. Raises
+    ValueError for invalid arguments.
+    '''
+    if kind not in EXPORTS:
+        raise ValueError(f'Nothing to export called {kind}.')
+    if output not in RENDERERS:
+        raise ValueError(f'output must be one of {", ".join(RENDERERS)}.')
+    queryset, fields = EXPORTS[kind](parse_bound(since, 'since'), parse_bound(until, 'until'), status)
+    columns = [column for column, _ in fields]
+    chunks = iter_chunks(queryset, [lookup for _, lookup in fields], chunk_size)
+    return OUTPUTS[output], RENDERERS[output](columns, chunks)
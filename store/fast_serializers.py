@@ -0,0 +1,230 @@
+from functools import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import ForeignKey
+from rest_framework import fields as drf_fields, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from .serializers import TAX_RATE, OrderSerializer, ProductSerializer
+
+# The ways a field is filled in, see Plan
+COLUMN, NESTED, BATCHED = range(3)
+
+# Fields whose to_representation() is a no-op on the values the database returns
+PASSTHROUGH_FIELDS = (
+    drf_fields.IntegerField, drf_fields.CharField, drf_fields.SlugField, drf_fields.EmailField,
+    drf_fields.BooleanField, serializers.PrimaryKeyRelatedField,
+)
+
+
+def get_converter(field):
+    '''
+    Returns what turns a column value into the field's representation,
+    None when the value is used as is.
+    '''
+    if type(field) in PASSTHROUGH_FIELDS:
+        return None
+    if type(field) is drf_fields.DecimalField and field.decimal_places is not None and not field.normalize_output \
+            and not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        # The database hands back decimals with the column's places already, quantizing them again changes nothing
+        exponent = -field.decimal_places
+        to_representation = field.to_representation
+        return lambda value: value if value.as_tuple().exponent == exponent else to_representation(value)
+    return field.to_representation
+
+
+class Plan:
+    '''
+    How to build one serializer's output from .values() rows: the lookups to
+    select and, for each field in order, where its value comes from.
+    '''
+
+    def __init__(self, serializer, prefix=''):
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        self.lookups = []
+        self.fields = []
+        self.batched = []
+        self.null_lookup = None
+        # Whether serializing runs queries of its own, for the nested lists
+        self.queries = False
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                self.add_batched(name, field)
+            elif isinstance(field, serializers.ListSerializer):
+                self.add_batched(name, field)
+                self.queries = True
+            elif isinstance(field, serializers.ModelSerializer):
+                model_field = self.get_model_field(name, field)
+                nested = Plan(field, f'{prefix}{model_field.name}__')
+                if model_field.null:
+                    nested.null_lookup = self.add_lookup(model_field.attname)
+                self.lookups += nested.lookups
+                self.fields.append((name, NESTED, nested))
+            else:
+                model_field = self.get_model_field(name, field)
+                attname = model_field.attname if isinstance(model_field, ForeignKey) else model_field.name
+                self.fields.append((name, COLUMN, (self.add_lookup(attname), get_converter(field))))
+
+    def get_model_field(self, name, field):
+        if len(field.source_attrs) != 1:
+            raise ImproperlyConfigured(f'{self.model.__name__}.{name}: only plain model fields can be read with values()')
+        return self.model._meta.get_field(field.source_attrs[0])
+
+    def add_lookup(self, name):
+        lookup = self.prefix + name
+        if lookup not in self.lookups:
+            self.lookups.append(lookup)
+        return lookup
+
+    def add_batched(self, name, field):
+        if self.prefix:
+            raise ImproperlyConfigured(f'{self.model.__name__}.{name}: computed fields are only supported at the top level')
+        self.batched.append((name, field))
+        self.fields.append((name, BATCHED, name))
+
+    def build(self, row, batched=None, index=None):
+        if self.null_lookup is not None and row[self.null_lookup] is None:
+            return None
+        item = {}
+        for name, kind, source in self.fields:
+            if kind is COLUMN:
+                lookup, convert = source
+                value = row[lookup]
+                item[name] = value if convert is None or value is None else convert(value)
+            elif kind is NESTED:
+                item[name] = source.build(row)
+            else:
+                item[name] = batched[source][index]
+        return item
+
+
+class FastSerializer:
+    '''
+    Read-only counterpart of `serializer_class` for list endpoints. Rows are
+    read with .values() over only the columns the output needs and turned
+    into the same data the serializer would return, without building model
+    instances or going through the serializer fields row by row.
+
+    Computed fields are filled in a page at a time: a SerializerMethodField
+    `name` by `compute_<name>(rows)` and a nested many=True serializer on a
+    reverse foreign key by one extra query.
+    '''
+    serializer_class = None
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    @classmethod
+    def supports(cls, request):
+        return True
+
+    @classmethod
+    def get_plan(cls):
+        return get_plan(cls.serializer_class)
+
+    def values(self, queryset):
+        '''
+        Returns the queryset as .values() rows, with whatever columns the
+        ordering needs for pagination cursors.
+        '''
+        plan = self.get_plan()
+        query = queryset.query
+        ordering = query.order_by or (query.default_ordering and queryset.model._meta.ordering) or []
+        pk_name = queryset.model._meta.pk.name
+        extra = [
+            pk_name if name == 'pk' else name
+            for name in (field.lstrip('-') for field in ordering if isinstance(field, str))
+        ]
+        lookups = plan.lookups + [name for name in [pk_name, *extra] if name not in plan.lookups]
+        # The related rows come from compute_<name>() instead
+        return queryset.prefetch_related(None).values(*lookups)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        plan = self.get_plan()
+        batched = {}
+        for name, field in plan.batched:
+            if isinstance(field, serializers.ListSerializer):
+                batched[name] = self.compute_children(plan, name, field, rows)
+            else:
+                compute = getattr(self, f'compute_{name}', None)
+                if compute is None:
+                    raise ImproperlyConfigured(f'{type(self).__name__} needs a compute_{name}(rows) method')
+                batched[name] = compute(rows)
+        return [plan.build(row, batched, index) for index, row in enumerate(rows)]
+
+    def compute_children(self, plan, name, field, rows):
+        relation = plan.model._meta.get_field(field.source)
+        if not relation.one_to_many:
+            raise ImproperlyConfigured(f'{plan.model.__name__}.{name}: only reverse foreign keys can be nested')
+        child = get_plan(type(field.child))
+        foreign_key = relation.field.attname
+        pk_name = plan.model._meta.pk.attname
+        children = {row[pk_name]: [] for row in rows}
+        if children:
+            related = relation.related_model
+            queryset = related._default_manager \
+                .filter(**{f'{foreign_key}__in': list(children)}) \
+                .order_by(*(related._meta.ordering or ['pk'])) \
+                .values(foreign_key, *child.lookups)
+            for row in queryset:
+                children[row[foreign_key]].append(child.build(row))
+        return [children[row[pk_name]] for row in rows]
+
+
+@cache
+def get_plan(serializer_class):
+    return Plan(serializer_class())
+
+
+class FastListMixin:
+    '''
+    Serves list requests through `fast_serializer_class` when it supports
+    the request, and through the regular serializer otherwise.
+    '''
+    fast_serializer_class = None
+
+    def get_fast_serializer(self):
+        if self.fast_serializer_class is None or not self.fast_serializer_class.supports(self.request):
+            return None
+        return self.fast_serializer_class(context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_fast_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+
+class FastProductSerializer(FastSerializer):
+    serializer_class = ProductSerializer
+
+    @classmethod
+    def supports(cls, request):
+        # The ?include= fields prefetch onto model instances
+        return not ProductSerializer.get_included(request)
+
+    def compute_price_with_tax(self, rows):
+        # Pages repeat a handful of prices, so each distinct one is multiplied once.
+        # Prices come back quantized to the column, so equal prices are also equal digit for digit.
+        taxed = {}
+        prices = []
+        for row in rows:
+            unit_price = row['unit_price']
+            price = taxed.get(unit_price)
+            if price is None:
+                price = taxed[unit_price] = unit_price * TAX_RATE
+            prices.append(price)
+        return prices
+
+
+class FastOrderSerializer(FastSerializer):
+    serializer_class = OrderSerializer
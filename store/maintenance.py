@@ -0,0 +1,69 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+from .cache import forget_cart_versions
+from .models import Cart, CartItem
+
+# Totals so far, passed to the progress callback after every batch
+PurgeProgress = namedtuple('PurgeProgress', ['batches', 'carts', 'items', 'elapsed'])
+
+
+def get_cart_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'STORE_CART_EXPIRY_DAYS', 30)
+    return timezone.now() - timedelta(days=days)
+
+
+def count_expired_carts(cutoff):
+    return (
+        Cart.objects.filter(created_at__lt=cutoff).count(),
+        CartItem.objects.filter(cart__created_at__lt=cutoff).count(),
+    )
+
+
+def purge_carts(cutoff, batch_size=500, pause=0, limit=None, progress=None):
+    '''
+    Deletes the carts created before `cutoff`, oldest first, `batch_size` at
+    a time, and returns the final PurgeProgress.
+
+    Each batch is its own short transaction that locks its carts, deletes
+    their items and then the carts, so the cart endpoints only ever wait on
+    a few rows. `pause` seconds between batches throttle the purge and
+    `limit` caps the number of carts deleted in one run, so it can be
+    scheduled on a busy database.
+    '''
+    db = router.db_for_write(Cart)
+    skip_locked = connections[db].features.has_select_for_update_skip_locked
+    started = time.monotonic()
+    batches = carts = items = 0
+
+    while limit is None or carts < limit:
+        size = batch_size if limit is None else min(batch_size, limit - carts)
+        with transaction.atomic(using=db):
+            # Walks the created_at index; carts someone is using right now are left for the next run
+            cart_ids = list(
+                Cart.objects.using(db)
+                .select_for_update(skip_locked=skip_locked)
+                .filter(created_at__lt=cutoff)
+                .order_by('created_at')
+                .values_list('pk', flat=True)[:size]
+            )
+            if not cart_ids:
+                break
+            items += CartItem.objects.using(db).filter(cart_id__in=cart_ids).delete()[0]
+            carts += Cart.objects.using(db).filter(pk__in=cart_ids).delete()[1].get(Cart._meta.label, 0)
+            # The delete signals bump the versions, which would keep them around for deleted carts
+            forget_cart_versions(*cart_ids)
+
+        batches += 1
+        if progress is not None:
+            progress(PurgeProgress(batches, carts, items, time.monotonic() - started))
+        if len(cart_ids) < size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return PurgeProgress(batches, carts, items, time.monotonic() - started)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from store.models import Product
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class RemoteAsyncClient(AsyncClient):
+    # An address outside INTERNAL_IPS keeps the debug toolbar out of the measurements
+    def _base_scope(self, **request):
+        scope = super()._base_scope(**request)
+        scope['client'] = ['192.0.2.1', 0]
+        scope['headers'] = [
+            (name, b'localhost' if name == b'host' else value) for name, value in scope['headers']
+        ]
+        return scope
+
+
+class ThreadCounter:
+    '''
+    Samples threading.active_count() in the background to record the
+    highest number of threads alive during a run.
+    '''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+class Command(BaseCommand):
+    help = ('Compares the async catalog endpoints served through the ASGI handler with the sync '
+            'viewsets served through the WSGI handler and a thread pool, at the same concurrency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=1000,
+                            help='Requests in flight at once (default 1000).')
+        parser.add_argument('--threads', type=int, default=64,
+                            help='Worker threads for the sync path, like a WSGI server would have.')
+        parser.add_argument('--path', default='products/', help='Endpoint under /store/ to request.')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Record peak memory with tracemalloc, this slows every path down considerably.')
+
+    def handle(self, *args, **options):
+        if options['path'] == 'products/' and not Product.objects.exists():
+            raise CommandError('No products to serve, run seed_data first.')
+
+        runs = [
+            ('async (ASGI)', self.run_async, f'/store/async/{options["path"]}'),
+            ('sync (ASGI)', self.run_async, f'/store/{options["path"]}'),
+            ('sync (WSGI)', self.run_threads, f'/store/{options["path"]}'),
+        ]
+        for label, run, url in runs:
+            if options['trace_memory']:
+                tracemalloc.start()
+            with ThreadCounter() as threads:
+                started = time.perf_counter()
+                latencies, statuses = run(url, options)
+                elapsed = time.perf_counter() - started
+
+            line = (
+                f'{label:<14} {len(latencies) / elapsed:8.1f} req/s  '
+                f'p50 {percentile(latencies, 0.5) * 1000:8.1f}ms  p99 {percentile(latencies, 0.99) * 1000:8.1f}ms  '
+                f'peak threads {threads.peak:4d}'
+            )
+            if options['trace_memory']:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                line += f'  peak memory {peak_memory / 1024 / 1024:6.1f}MiB'
+            errors = sum(1 for status in statuses if status != 200)
+            if errors:
+                line += f'  {errors} errors'
+            self.stdout.write(line)
+
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f'{connection.vendor} has no async driver, the async ORM still runs every query '
+                'in a sync_to_async thread so the async path saves threads but not database time.'
+            ))
+
+    def run_async(self, url, options):
+        client = RemoteAsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+        statuses = []
+
+        async def fetch():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url, headers={'Accept': 'application/json'})
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+        async def main():
+            await asyncio.gather(*(fetch() for _ in range(options['requests'])))
+
+        asyncio.run(main())
+        return latencies, statuses
+
+    def run_threads(self, url, options):
+        local = threading.local()
+
+        def fetch(_):
+            if not hasattr(local, 'client'):
+                local.client = Client(SERVER_NAME='localhost', REMOTE_ADDR='192.0.2.1')
+            started = time.perf_counter()
+            response = local.client.get(url, HTTP_ACCEPT='application/json')
+            return time.perf_counter() - started, response.status_code
+
+        # Requests beyond the pool size queue up, the same as connections waiting on a WSGI server
+        with ThreadPoolExecutor(max_workers=min(options['threads'], options['concurrency'])) as pool:
+            results = list(pool.map(fetch, range(options['requests'])))
+        return [latency for latency, _ in results], [status for _, status in results]
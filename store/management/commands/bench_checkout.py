@@ -0,0 +1,109 @@
+import random
+import time
+from threading import Thread
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core.models import User
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product
+from store.serializers import CreateOrderSerializer
+
+PREFIX = 'bench-checkout'
+
+
+class Command(BaseCommand):
+    help = 'Measures checkout throughput with concurrent customers ordering the same few products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=400, help='Orders placed in total.')
+        parser.add_argument('--skus', type=int, default=3, help='Number of hot products every cart draws from.')
+        parser.add_argument('--lines', type=int, default=2, help='Products per cart.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Don't delete the generated data afterwards.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        threads = options['threads']
+        lines = min(options['lines'], options['skus'])
+
+        collection = Collection.objects.create(title=PREFIX)
+        Product.objects.bulk_create([
+            Product(title=f'{PREFIX}-{i}', slug=f'{PREFIX}-{i}', unit_price=10,
+                    inventory=options['orders'] * 10, collection=collection)
+            for i in range(options['skus'])
+        ])
+        # Read back, bulk_create() doesn't set the primary keys on MySQL
+        products = list(Product.objects.filter(collection=collection).order_by('pk'))
+        users = [
+            User.objects.create(username=f'{PREFIX}-{i}', email=f'{PREFIX}-{i}@example.com')
+            for i in range(threads)
+        ]
+        for user in users:
+            Customer.objects.get_or_create(user=user)
+
+        carts = [[] for _ in range(threads)]
+        for index in range(options['orders']):
+            cart = Cart.objects.create()
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=rng.randint(1, 3))
+                for product in rng.sample(products, lines)
+            ])
+            carts[index % threads].append(cart.id)
+
+        latencies = []
+        failures = []
+
+        def checkout(user, cart_ids):
+            try:
+                for cart_id in cart_ids:
+                    started = time.perf_counter()
+                    try:
+                        serializer = CreateOrderSerializer(data={'cart_id': cart_id}, context={'user_id': user.id})
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                        latencies.append(time.perf_counter() - started)
+                    except Exception as error:
+                        failures.append(error)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=checkout, args=(users[i], carts[i])) for i in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        self.stdout.write(f'{len(latencies)} orders in {elapsed:.2f}s with {threads} threads on {options["skus"]} products')
+        self.stdout.write(f'throughput: {len(latencies) / elapsed:.1f} orders/s')
+        if latencies:
+            self.stdout.write('latency p50: {:.1f}ms  p95: {:.1f}ms  max: {:.1f}ms'.format(
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.95)] * 1000,
+                latencies[-1] * 1000,
+            ))
+
+        errors = []
+        if failures:
+            errors.append(f'{len(failures)} checkouts failed, first error: {failures[0]!r}')
+        expected = sum(
+            quantity for quantity in
+            OrderItem.objects.filter(product__in=products).values_list('quantity', flat=True)
+        )
+        remaining = sum(Product.objects.filter(pk__in=[p.pk for p in products]).values_list('inventory', flat=True))
+        if remaining + expected != options['orders'] * 10 * len(products):
+            errors.append('Inventory does not add up: some decrements were lost')
+
+        if not options['keep']:
+            with transaction.atomic():
+                OrderItem.objects.filter(product__in=products).delete()
+                Order.objects.filter(customer__user__in=users).delete()
+                Cart.objects.filter(pk__in=[cart_id for group in carts for cart_id in group]).delete()
+                Product.objects.filter(pk__in=[p.pk for p in products]).delete()
+                collection.delete()
+                User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+        if errors:
+            raise CommandError('\n'.join(errors))
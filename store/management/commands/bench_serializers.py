@@ -0,0 +1,63 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.settings import api_settings
+from store.fast_serializers import FastProductSerializer
+from store.models import Collection, Product
+from store.serializers import ProductSerializer
+
+PREFIX = 'bench-serializers'
+
+
+class Command(BaseCommand):
+    help = ('Times reading and serializing a large page of products with ProductSerializer and with '
+            'the values()-based FastProductSerializer, and checks both render the same bytes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Products serialized per round.')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help="Don't delete the generated products afterwards.")
+
+    def handle(self, *args, **options):
+        count = options['products']
+        missing = count - Product.objects.count()
+        collection = None
+        if missing > 0:
+            collection = Collection.objects.create(title=PREFIX)
+            Product.objects.bulk_create([
+                Product(title=f'{PREFIX}-{i}', slug=f'{PREFIX}-{i}', unit_price=Decimal(10 + i % 90) + Decimal('0.99'),
+                        inventory=10, collection=collection, description=f'Product {i}' if i % 2 else None)
+                for i in range(missing)
+            ], batch_size=1000)
+
+        try:
+            queryset = Product.objects.order_by('title', 'pk')[:count]
+            renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+
+            def regular():
+                return renderer.render(ProductSerializer(queryset.all(), many=True).data)
+
+            def fast():
+                serializer = FastProductSerializer()
+                return renderer.render(serializer.serialize(serializer.values(queryset.all())))
+
+            if regular() != fast():
+                raise CommandError('FastProductSerializer output differs from ProductSerializer')
+
+            timings = {}
+            for name, function in [('ProductSerializer', regular), ('FastProductSerializer', fast)]:
+                times = []
+                for _ in range(options['rounds']):
+                    started = time.perf_counter()
+                    function()
+                    times.append(time.perf_counter() - started)
+                timings[name] = min(times)
+                self.stdout.write(f'{name}: best of {options["rounds"]} {timings[name] * 1000:.1f}ms '
+                                  f'for {count} products, read and rendered')
+            self.stdout.write(f'speedup: {timings["ProductSerializer"] / timings["FastProductSerializer"]:.1f}x')
+        finally:
+            if collection is not None and not options['keep']:
+                with transaction.atomic():
+                    Product.objects.filter(collection=collection).delete()
+                    collection.delete()
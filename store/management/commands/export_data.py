@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from store import export
+
+
+class Command(BaseCommand):
+    help = 'Streams orders or products as NDJSON or CSV to a file or stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(export.EXPORTS))
+        parser.add_argument('--output', choices=list(export.RENDERERS), default='ndjson')
+        parser.add_argument('--since', help='ISO date or datetime, inclusive.')
+        parser.add_argument('--until', help='ISO date or datetime, exclusive.')
+        parser.add_argument('--status', help='Order payment status (P, C or F).')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+        parser.add_argument('--file', help='Write to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            _, rows = export.export(
+                options['kind'], options['output'],
+                since=options['since'], until=options['until'], status=options['status'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['file']:
+            with open(options['file'], 'w', newline='') as file:
+                file.writelines(rows)
+        else:
+            for chunk in rows:
+                self.stdout.write(chunk, ending='')
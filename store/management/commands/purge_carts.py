@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.maintenance import count_expired_carts, get_cart_cutoff, purge_carts
+
+
+class Command(BaseCommand):
+    help = ('Deletes carts older than STORE_CART_EXPIRY_DAYS, with their items, in small batches '
+            'oldest first. Safe to run from cron while the store is serving, -v 2 reports every batch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Purge carts created more than this many days ago '
+                                                     '(defaults to STORE_CART_EXPIRY_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=500, help='Carts deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches, to go easy on a busy database.')
+        parser.add_argument('--limit', type=int, help='Stop after deleting this many carts.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many carts would be purged.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        cutoff = get_cart_cutoff(options['days'])
+
+        if options['dry_run']:
+            carts, items = count_expired_carts(cutoff)
+            self.stdout.write(f'{carts} carts with {items} items were created before {cutoff:%Y-%m-%d %H:%M}')
+            return
+
+        def report(progress):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'batch {progress.batches}: {progress.carts} carts, {progress.items} items '
+                                  f'in {progress.elapsed:.1f}s ({progress.carts / max(progress.elapsed, 1e-6):.0f} carts/s)')
+
+        progress = purge_carts(cutoff, options['batch_size'], options['pause'], options['limit'], report)
+        self.stdout.write(self.style.SUCCESS(
+            f'{progress.carts} carts with {progress.items} items created before {cutoff:%Y-%m-%d %H:%M} '
+            f'were purged in {progress.batches} batches and {progress.elapsed:.1f}s'
+        ))
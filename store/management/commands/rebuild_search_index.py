@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = get_backend().rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{indexed} products were indexed'))
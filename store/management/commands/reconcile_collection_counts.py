@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Collection.products_count wherever it drifted from the real product count.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted collections.')
+
+    def handle(self, *args, **options):
+        drifted = Collection.objects \
+            .annotate(actual_count=Count('products')) \
+            .exclude(products_count=F('actual_count')) \
+            .values_list('id', 'title', 'products_count', 'actual_count')
+
+        actual_counts = Subquery(
+            Product.objects
+                .filter(collection=OuterRef('pk'))
+                .order_by()
+                .values('collection')
+                .annotate(count=Count('pk'))
+                .values('count')
+        )
+        fixed = 0
+        for (collection_id, title, stored, actual) in drifted:
+            self.stdout.write(f'{title} (#{collection_id}): stored {stored}, actual {actual}')
+            if not options['dry_run']:
+                # Recount inside the UPDATE so products added meanwhile aren't lost. The subquery reads
+                # store_product only, MySQL refuses subqueries on the table being updated (error 1093)
+                Collection.objects.filter(pk=collection_id).update(products_count=Coalesce(actual_counts, 0))
+                fixed += 1
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted)} collections have drifted')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{fixed} collections were reconciled'))
@@ -1,19 +1,121 @@
 from django.conf import settings
 from django.contrib import admin
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, Prefetch, Sum, Value, When
 from django.core.validators import MinValueValidator
 from uuid import uuid4
+from collections import Counter
+from functools import partial
+from django.core.cache import cache
+from core.versions import bump_version
+from .cache import CUSTOMER_ID_KEY, CUSTOMER_ID_TIMEOUT, bump_cart_version
+
+
+class VersionedQuerySet(models.QuerySet):
+    '''
+    Bulk writes skip the save/delete signals, so they bump the response
+    cache version themselves.
+    '''
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bump_version(self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_version(self.model)
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        rows = super().bulk_update(objs, *args, **kwargs)
+        bump_version(self.model)
+        return rows
+
+
+class CollectionQuerySet(VersionedQuerySet):
+    def adjust_products_count(self, deltas):
+        '''
+        Applies {collection_id: delta} to the stored products_count in a
+        single UPDATE.
+        '''
+        deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and delta}
+        if not deltas:
+            return 0
+        return self.filter(pk__in=deltas).update(products_count=F('products_count') + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            default=Value(0)
+        ))
+
+
+def _reindex(queryset):
+    # store.search imports the models, so it can only be loaded once they are defined
+    from .search import get_backend
+    get_backend().rebuild(queryset)
+
+
+class ProductQuerySet(VersionedQuerySet):
+    '''
+    Keeps Collection.products_count and the search index in step with bulk
+    writes, which don't send the signals the per-object path relies on.
+    '''
+    search_fields = {'title', 'description'}
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            last_pk = self.model.objects.using(self.db).order_by('-pk').values_list('pk', flat=True).first()
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Collection.objects.adjust_products_count(Counter(obj.collection_id for obj in objs))
+            if all(obj.pk is not None for obj in objs):
+                _reindex(self.model.objects.using(self.db).filter(pk__in=[obj.pk for obj in objs]))
+            else:
+                # Backends that don't return the new keys, MySQL for one, get everything inserted since
+                _reindex(self.model.objects.using(self.db).filter(pk__gt=last_pk or 0))
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self.search_fields & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic(using=self.db):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            _reindex(self.model.objects.using(self.db).filter(pk__in=[obj.pk for obj in objs]))
+        return rows
+
+    def update(self, **kwargs):
+        moves = 'collection' in kwargs or 'collection_id' in kwargs
+        reindex = bool(self.search_fields & kwargs.keys())
+        if not moves and not reindex:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            if reindex:
+                # Taken first, the update can change what the filter matches
+                pks = list(self.values_list('pk', flat=True))
+            deltas = Counter()
+            if moves:
+                for row in self.values('collection_id').annotate(products=Count('id')).order_by():
+                    deltas[row['collection_id']] -= row['products']
+            rows = super().update(**kwargs)
+            if moves:
+                collection = kwargs.get('collection', kwargs.get('collection_id'))
+                deltas[getattr(collection, 'pk', collection)] += rows
+                Collection.objects.adjust_products_count(deltas)
+            if reindex:
+                _reindex(self.model.objects.using(self.db).filter(pk__in=pks))
+        return rows
 
 
 class Promotion(models.Model):
+    objects = VersionedQuerySet.as_manager()
     description = models.CharField(max_length=255)
     discount = models.FloatField()
 
 
 class Collection(models.Model):
+    objects = CollectionQuerySet.as_manager()
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+')
+    products_count = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -23,6 +125,7 @@ class Collection(models.Model):
 
 
 class Product(models.Model):
+    objects = ProductQuerySet.as_manager()
     title = models.CharField(max_length=255)
     slug = models.SlugField()
     description = models.TextField(null=True, blank=True)
@@ -34,9 +137,53 @@ class Product(models.Model):
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the products_count signal handler notice a collection change.
+        # Left unset when deferred, the handler then reads it before saving.
+        if 'collection_id' in instance.__dict__:
+            instance._loaded_collection_id = instance.collection_id
+        return instance
     
     class Meta:
         ordering = ['title']
+        # The id tiebreaker lets keyset pages read straight off the index
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+        ]
+
+
+class ProductSearchTerm(models.Model):
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
+
+
+class CustomerQuerySet(models.QuerySet):
+    def id_for_user(self, user_id):
+        '''
+        Returns the id of the user's customer, creating the customer on first
+        use. The mapping is cached, the Customer signals drop it when the
+        customer is deleted or moves to another user.
+        '''
+        key = CUSTOMER_ID_KEY.format(user_id)
+        customer_id = cache.get(key)
+        if customer_id is None:
+            customer, created = self.only('id').get_or_create(user_id=user_id)
+            customer_id = customer.id
+            if created:
+                # A rolled back creation must not leave its id behind
+                transaction.on_commit(partial(cache.set, key, customer_id, CUSTOMER_ID_TIMEOUT))
+            else:
+                cache.set(key, customer_id, CUSTOMER_ID_TIMEOUT)
+        return customer_id
 
 
 class Customer(models.Model):
@@ -57,9 +204,17 @@ class Customer(models.Model):
     membership = models.CharField(
         max_length=1, choices=MEMBERSHIP_CHOICES, default=MEMBERSHIP_BRONZE)
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    objects = CustomerQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.user.first_name}  {self.user.last_name}" 
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the signal handlers notice a customer moving to another user
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        return instance
     
     @admin.display(ordering='user__first_name')
     def first_name(self):
@@ -72,7 +227,15 @@ class Customer(models.Model):
         permissions = [('view_history', 'Can view history')]
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        return self.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
+
+
 class Order(models.Model):
+    objects = OrderQuerySet.as_manager()
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
     PAYMENT_STATUS_FAILED = 'F'
@@ -86,11 +249,16 @@ class Order(models.Model):
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
 
     class Meta:
         permissions = [
             ('cancel_order', 'Can cancel order')
         ]
+        unique_together = [['customer', 'idempotency_key']]
+        indexes = [
+            models.Index(fields=['customer', 'placed_at']),
+        ]
 
 
 class OrderItem(models.Model):
@@ -107,12 +275,131 @@ class Address(models.Model):
         Customer, on_delete=models.CASCADE)
 
 
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        '''
+        Loads the items with their products and both line and cart totals
+        computed by the database.
+        '''
+        return self \
+            .annotate(total_price=Sum(line_total('items__'))) \
+            .prefetch_related(Prefetch('items', queryset=CartItem.objects.with_total_price()))
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.select_related('product').annotate(total_price=line_total())
+
+    def add(self, cart_id, product_id, quantity):
+        '''
+        Adds `quantity` of a product to a cart in a single statement, inserting
+        the item or incrementing the existing one. Returns None when there is
+        no such product.
+        '''
+        connection = connections[self.db]
+        features = connection.features
+        if connection.vendor == 'mysql':
+            item = self._add_on_duplicate_key(connection, cart_id, product_id, quantity)
+        elif features.supports_update_conflicts_with_target and features.can_return_rows_from_bulk_insert:
+            item = self._add_on_conflict(connection, cart_id, product_id, quantity)
+        else:
+            item = self._add_fallback(cart_id, product_id, quantity)
+        # The upserts skip the save signals
+        if item is not None:
+            bump_cart_version(cart_id)
+        return item
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_cart_version(*[obj.cart_id for obj in objs])
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        rows = super().bulk_update(objs, *args, **kwargs)
+        bump_cart_version(*[obj.cart_id for obj in objs])
+        return rows
+
+    def _upsert_params(self, connection, cart_id, product_id, quantity):
+        meta = self.model._meta
+        names = {
+            'item': meta.db_table,
+            'id': meta.pk.column,
+            'cart': meta.get_field('cart').column,
+            'product': meta.get_field('product').column,
+            'quantity': meta.get_field('quantity').column,
+            'product_table': Product._meta.db_table,
+            'product_id': Product._meta.pk.column,
+        }
+        names = {key: connection.ops.quote_name(name) for key, name in names.items()}
+        return names, [meta.get_field('cart').get_db_prep_value(cart_id, connection), quantity, product_id]
+
+    def _add_on_conflict(self, connection, cart_id, product_id, quantity):
+        names, params = self._upsert_params(connection, cart_id, product_id, quantity)
+        # The WHERE on the product row makes the insert a no-op for unknown products
+        sql = (
+            'INSERT INTO {item} ({cart}, {product}, {quantity}) '
+            'SELECT %s, {product_id}, %s FROM {product_table} WHERE {product_id} = %s '
+            'ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity} = {item}.{quantity} + excluded.{quantity} '
+            'RETURNING {id}, {quantity}'
+        ).format(**names)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return self.model(id=row[0], cart_id=cart_id, product_id=product_id, quantity=row[1])
+
+    def _add_on_duplicate_key(self, connection, cart_id, product_id, quantity):
+        names, params = self._upsert_params(connection, cart_id, product_id, quantity)
+        # LAST_INSERT_ID(id) makes lastrowid point at the row for updates too
+        sql = (
+            'INSERT INTO {item} ({cart}, {product}, {quantity}) '
+            'SELECT * FROM (SELECT %s AS new_cart, {product_id} AS new_product, %s AS new_quantity '
+            'FROM {product_table} WHERE {product_id} = %s) AS new '
+            'ON DUPLICATE KEY UPDATE {quantity} = {item}.{quantity} + new.new_quantity, {id} = LAST_INSERT_ID({id})'
+        ).format(**names)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.rowcount == 0:
+                return None
+            item_id = cursor.lastrowid
+        return self.get(pk=item_id)
+
+    def _add_fallback(self, cart_id, product_id, quantity):
+        with transaction.atomic(using=self.db):
+            items = self.filter(cart_id=cart_id, product_id=product_id)
+            if not items.update(quantity=F('quantity') + quantity):
+                if not Product.objects.filter(pk=product_id).exists():
+                    return None
+                try:
+                    with transaction.atomic(using=self.db):
+                        return self.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    # Somebody else inserted it first
+                    items.update(quantity=F('quantity') + quantity)
+            return items.get()
+
+
+def line_total(prefix=''):
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__unit_price'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
 class Cart(models.Model):
+    objects = CartQuerySet.as_manager()
     id = models.UUIDField(primary_key=True, default = uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
 
 class CartItem(models.Model):
+    objects = CartItemQuerySet.as_manager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(
@@ -1,4 +1,241 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+def estimate_count(queryset, cap=1000):
+    '''
+    Cheap replacement for queryset.count() on big tables.
+    An unfiltered queryset is answered from the planner statistics when the
+    backend keeps them, anything else is counted exactly up to `cap` rows.
+    '''
+    connection = connections[queryset.db]
+    if not queryset.query.where:
+        table = queryset.model._meta.db_table
+        sql = None
+        if connection.vendor == 'mysql':
+            sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+        elif connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)'
+        if sql:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [table])
+                row = cursor.fetchone()
+            if row and row[0] is not None and row[0] >= 0:
+                return int(row[0])
+    return queryset.order_by()[:cap].count()
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Cursor pagination over the queryset ordering with `id` as a tiebreaker,
+    so it works with whatever OrderingFilter applied. Pages are fetched with
+    a WHERE on the last seen row instead of OFFSET and no COUNT is run unless
+    the client asks for one with ?count=exact or ?count=estimate.
+
+    Clients that pass ?page=N keep getting DefaultPagination responses.
+    '''
+    page_size = DefaultPagination.page_size
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_query_param = DefaultPagination.page_query_param
+    page_number_class = DefaultPagination
+    estimate_cap = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param in request.query_params:
+            self.page_number = self.page_number_class()
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.page_number = None
+        page_queryset = self.get_page_queryset(queryset, request)
+        self.count = self.get_count(queryset)
+        return self.build_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''
+        Same as paginate_queryset() for async views, the rows are fetched
+        with the async ORM.
+        '''
+        if self.page_query_param in request.query_params:
+            self.page_number = self.page_number_class()
+            return await self.apaginate_page_number(queryset, request)
+
+        self.page_number = None
+        page_queryset = self.get_page_queryset(queryset, request)
+        self.count = await self.aget_count(queryset)
+        return self.build_page([instance async for instance in page_queryset])
+
+    async def apaginate_page_number(self, queryset, request):
+        pagination = self.page_number
+        paginator = pagination.django_paginator_class(queryset, pagination.get_page_size(request))
+        # Paginator.count is a cached property, filling it in keeps page() from counting synchronously
+        paginator.count = await queryset.acount()
+        page_number = pagination.get_page_number(request, paginator)
+        try:
+            pagination.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(pagination.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        pagination.request = request
+        return [instance async for instance in pagination.page.object_list]
+
+    def get_page_queryset(self, queryset, request):
+        '''
+        Returns the ordered, keyset-filtered queryset for the requested page,
+        limited to page_size + 1 rows so we know whether there is a next one.
+        '''
+        self.request = request
+        self.base_queryset = queryset
+        self.ordering = self.get_ordering(queryset)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter())
+            except (TypeError, ValueError, DjangoValidationError):
+                # A position that doesn't fit the fields, e.g. a cursor edited by hand
+                self.raise_invalid_cursor()
+        queryset = queryset.order_by(*[
+            ('-' if descending != self.reverse else '') + field
+            for field, descending in self.ordering
+        ])
+        return queryset[:self.page_size + 1]
+
+    def build_page(self, results):
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return results
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if not ordering and queryset.query.default_ordering:
+            ordering = queryset.model._meta.ordering
+
+        pk_name = queryset.model._meta.pk.name
+        fields = []
+        for field in ordering:
+            if not isinstance(field, str):
+                raise ImproperlyConfigured('KeysetPagination only supports ordering by field names.')
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            fields.append((pk_name if field == 'pk' else field, descending))
+
+        if pk_name not in [field for field, _ in fields]:
+            fields.append((pk_name, False))
+        return fields
+
+    def get_keyset_filter(self):
+        keyset = Q()
+        for index, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != self.reverse else 'gt'
+            condition = Q(**{f'{field}__{lookup}': self.position[index]})
+            for previous, (previous_field, _) in enumerate(self.ordering[:index]):
+                condition &= Q(**{previous_field: self.position[previous]})
+            keyset |= condition
+        return keyset
+
+    def get_count(self, queryset):
+        mode = self.request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset, self.estimate_cap)
+        return None
+
+    async def aget_count(self, queryset):
+        mode = self.request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return await queryset.acount()
+        if mode == 'estimate':
+            return await sync_to_async(estimate_count)(queryset, self.estimate_cap)
+        return None
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError):
+            self.raise_invalid_cursor()
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            self.raise_invalid_cursor()
+        return position, reverse
+
+    def raise_invalid_cursor(self):
+        # A malformed parameter, unlike DRF's CursorPagination which answers 404
+        raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('ascii')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_position(self, instance):
+        position = []
+        for field, _ in self.ordering:
+            value = instance
+            for part in field.split('__'):
+                value = value[part] if isinstance(value, dict) else getattr(value, part)
+            position.append(value if isinstance(value, (int, str)) or value is None else str(value))
+        return position
+
+    def get_next_link(self):
+        if self.page_number:
+            return self.page_number.get_next_link()
+        if self.reverse:
+            # We walked backwards to get here, so there is always a page after this one.
+            if self.page:
+                return self.encode_cursor(self.get_position(self.page[-1]), False)
+            return self.encode_cursor(self.position, False)
+        if self.has_more:
+            return self.encode_cursor(self.get_position(self.page[-1]), False)
+        return None
+
+    def get_previous_link(self):
+        if self.page_number:
+            return self.page_number.get_previous_link()
+        if not self.reverse:
+            if self.position is None:
+                return None
+            if self.page:
+                return self.encode_cursor(self.get_position(self.page[0]), True)
+            return self.encode_cursor(self.position, True)
+        if self.has_more:
+            return self.encode_cursor(self.get_position(self.page[0]), True)
+        return None
+
+    def get_paginated_response(self, data):
+        if self.page_number:
+            return self.page_number.get_paginated_response(data)
+
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
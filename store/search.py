@@ -0,0 +1,131 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Product, ProductSearchTerm
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = ProductSearchTerm._meta.get_field('term').max_length
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+class BaseSearchBackend:
+    def index(self, product):
+        raise NotImplementedError
+
+    def remove(self, product_id):
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        '''
+        Narrows the queryset down to the products matching the query and
+        annotates them with a `search_rank`, higher is better.
+        '''
+        raise NotImplementedError
+
+    def rebuild(self, queryset=None, batch_size=1000):
+        raise NotImplementedError
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    '''
+    Keeps a (term, product, weight) posting table in the database. A query
+    term matches every indexed term it is a prefix of, which is an index
+    range scan instead of a LIKE '%term%' over the description column.
+    Like SearchFilter, a product has to match every term of the query.
+    '''
+    title_weight = 3
+    description_weight = 1
+
+    def get_terms(self, product):
+        weights = Counter()
+        for token in tokenize(product.title):
+            weights[token] += self.title_weight
+        for token in tokenize(product.description):
+            weights[token] += self.description_weight
+        return weights
+
+    def get_postings(self, product):
+        return [
+            ProductSearchTerm(term=term, product_id=product.pk, weight=weight)
+            for term, weight in self.get_terms(product).items()
+        ]
+
+    def index(self, product):
+        with transaction.atomic():
+            ProductSearchTerm.objects.filter(product_id=product.pk).delete()
+            ProductSearchTerm.objects.bulk_create(self.get_postings(product))
+
+    def remove(self, product_id):
+        ProductSearchTerm.objects.filter(product_id=product_id).delete()
+
+    def search(self, queryset, query):
+        terms = set(tokenize(query))
+        if not terms:
+            return queryset
+
+        match = Q()
+        for term in terms:
+            match |= Q(term__startswith=term)
+            queryset = queryset.filter(pk__in=ProductSearchTerm.objects.filter(term__startswith=term).values('product_id'))
+        rank = ProductSearchTerm.objects.filter(match, product=OuterRef('pk')) \
+            .values('product') \
+            .annotate(rank=Sum('weight')) \
+            .values('rank')
+
+        return queryset \
+            .annotate(search_rank=Subquery(rank)) \
+            .order_by('-search_rank', 'pk')
+
+    def rebuild(self, queryset=None, batch_size=1000):
+        if queryset is None:
+            queryset = Product.objects.all()
+        queryset = queryset.only('id', 'title', 'description').order_by('pk')
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return indexed
+            with transaction.atomic():
+                ProductSearchTerm.objects.filter(product__in=batch).delete()
+                postings = []
+                for product in batch:
+                    postings += self.get_postings(product)
+                ProductSearchTerm.objects.bulk_create(postings, batch_size=batch_size)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+
+
+_backends = {}
+
+
+def get_backend():
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', 'store.search.InvertedIndexBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    '''
+    Drop-in replacement for SearchFilter on ProductViewSet that answers
+    ?search= from the configured search backend, ranked by relevance
+    unless an explicit ordering is requested.
+    '''
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return get_backend().search(queryset, query)
@@ -1,9 +1,16 @@
-from django.db import transaction
+from collections import namedtuple
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from decimal import Decimal
 from .models import Product, Collection, Review, Cart, CartItem, Customer, Order, OrderItem
 from pprint import pprint
 
+PRICE_PLACES = Decimal('0.01')
+TAX_RATE = Decimal('1.1')
+
 class CollectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Collection
@@ -13,16 +20,62 @@ class CollectionSerializer(serializers.ModelSerializer):
     title = serializers.CharField(max_length = 255)
     products_count = serializers.IntegerField(read_only = True)
 
+# An extra product field other apps can offer, see ProductSerializer.register_optional_field()
+OptionalField = namedtuple('OptionalField', ['field', 'prefetch', 'models'])
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, BaseManager) else data)
+        self.child.prefetch(products)
+        return super().to_representation(products)
+
 class ProductSerializer(serializers.ModelSerializer):
     '''
     { "title" : "a", "slug" : "a" , "collection" : 1, "unit_price" : 1, "inventory" : 1 }
     '''
+    optional_fields = {}
+
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection']
+        list_serializer_class = ProductListSerializer
+
+    @classmethod
+    def register_optional_field(cls, name, field, prefetch, models=()):
+        '''
+        Offers an extra field that clients ask for with ?include=name.
+        `field()` builds the serializer field, `prefetch(products)` runs once
+        for all the products being serialized and attaches what the field
+        reads, and `models` are the models whose changes alter its value.
+        '''
+        cls.optional_fields[name] = OptionalField(field, prefetch, tuple(models))
+
+    @classmethod
+    def get_included(cls, request):
+        if request is None:
+            return []
+        names = request.query_params.get('include', '').split(',')
+        return [name for name in cls.optional_fields if name in names]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.get_included(self.context.get('request')):
+            fields[name] = self.optional_fields[name].field()
+        return fields
+
+    def prefetch(self, products):
+        for name in self.get_included(self.context.get('request')):
+            self.optional_fields[name].prefetch(products)
+
+    def to_representation(self, instance):
+        # Lists prefetch in ProductListSerializer
+        if self.parent is None:
+            self.prefetch([instance])
+        return super().to_representation(instance)
+
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')    
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        return product.unit_price * TAX_RATE
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
@@ -48,6 +101,9 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='calculate_total_price')
 
     def calculate_total_price(self, cart_item : CartItem):
+        if hasattr(cart_item, 'total_price'):
+            # Some backends (SQLite) don't round computed decimals to the field's places
+            return cart_item.total_price.quantize(PRICE_PLACES)
         return cart_item.product.unit_price * cart_item.quantity
 
 class CartSerializer(serializers.ModelSerializer):
@@ -61,6 +117,9 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='calculate_total_price')
 
     def calculate_total_price(self, cart : Cart):
+        # Carts loaded through Cart.objects.with_items() are summed in SQL
+        if hasattr(cart, 'total_price'):
+            return cart.total_price.quantize(PRICE_PLACES) if cart.total_price is not None else 0
         total = 0
         for item in cart.items.all():
             total += item.quantity * item.product.unit_price
@@ -73,27 +132,67 @@ class AddCartItemSerializer(serializers.ModelSerializer):
 
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError("No Product with the passed id")
-        return value
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            # Update if exists
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id = product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            # Create if it doesn't exist
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-        
+        # Inserts or increments in one statement, which also checks the product exists
+        self.instance = CartItem.objects.add(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError({'product_id': ["No Product with the passed id"]})
+
         return self.instance
 
+class BulkCartItemSerializer(serializers.ListSerializer):
+    '''
+    Sets the quantity of every listed product in the cart at once,
+    creating the items that don't exist yet.
+    '''
+    def validate(self, entries):
+        product_ids = [entry['product_id'] for entry in entries]
+        if len(set(product_ids)) != len(product_ids):
+            raise serializers.ValidationError("Each product can only be listed once")
+
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        missing = [product_id for product_id in product_ids if product_id not in found]
+        if missing:
+            raise serializers.ValidationError(f"No Product with the passed ids: {missing}")
+        return entries
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = {entry['product_id']: entry['quantity'] for entry in self.validated_data}
+
+        with transaction.atomic():
+            # Locking the cart serializes concurrent syncs of the same basket
+            if not Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk').exists():
+                raise NotFound("No cart with the ID was found")
+
+            existing = CartItem.objects \
+                .select_for_update() \
+                .filter(cart_id=cart_id, product_id__in=quantities)
+            updated = []
+            for item in existing:
+                item.quantity = quantities.pop(item.product_id)
+                updated.append(item)
+
+            CartItem.objects.bulk_update(updated, ['quantity'])
+            CartItem.objects.bulk_create([
+                CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items()
+            ])
+
+        return Cart.objects.with_items().get(pk=cart_id)
+
+
+class BulkCartItemEntrySerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+    class Meta:
+        list_serializer_class = BulkCartItemSerializer
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -125,30 +224,70 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
 class CreateOrderSerializer(serializers.Serializer):
     # 2022eeb1-a57f-4699-96ac-bf4ad4a0ae23
     cart_id = serializers.UUIDField()
+    idempotency_key = serializers.CharField(max_length=255, required=False)
 
-    def validate_cart_id(self, cart_id):
-        if Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError("No cart with the ID was found")
-        if CartItem.objects.filter(cart_id = cart_id).count() == 0:
-            raise serializers.ValidationError("Cart is empty")
-        return cart_id
-    
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-            (customer, created) = Customer.objects.get_or_create(user_id = self.context['user_id'])
-            order = Order.objects.create(customer=customer)
+        cart_id = self.validated_data['cart_id']
+        key = self.validated_data.get('idempotency_key') or self.context.get('idempotency_key')
+        customer_id = Customer.objects.id_for_user(self.context['user_id'])
+
+        if key:
+            # A retried request gets the order its first attempt placed
+            order = Order.objects.filter(customer_id=customer_id, idempotency_key=key).first()
+            if order is not None:
+                return order
+
+        try:
+            with transaction.atomic():
+                return self.place_order(customer_id, cart_id, key)
+        except IntegrityError:
+            if key is None:
+                raise
+            # A concurrent retry with the same key won the race
+            return Order.objects.get(customer_id=customer_id, idempotency_key=key)
+
+    def place_order(self, customer_id, cart_id, key):
+        # Locking the cart first makes a concurrent checkout of the same cart wait and then find it gone
+        cart_exists = Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk').exists()
+        if key:
+            # A retry that waited on the lock gets the order the first attempt placed meanwhile
+            order = Order.objects.filter(customer_id=customer_id, idempotency_key=key).first()
+            if order is not None:
+                return order
+        if not cart_exists:
+            raise serializers.ValidationError({'cart_id': ["No cart with the ID was found"]})
+
+        quantities = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+        if not quantities:
+            raise serializers.ValidationError({'cart_id': ["Cart is empty"]})
 
-            cart_items = CartItem.objects.select_related('product').filter(cart_id = cart_id)
-            order_items = [
-                OrderItem(order=order, product=item.product, 
-                        unit_price = item.product.unit_price,
-                            quantity=item.quantity)
-                            for item in cart_items]
+        # Rows are locked in primary key order so concurrent checkouts can't deadlock
+        products = Product.objects \
+            .select_for_update() \
+            .filter(pk__in=quantities) \
+            .order_by('pk') \
+            .only('id', 'unit_price', 'inventory')
+        unit_prices = {}
+        out_of_stock = []
+        for product in products:
+            unit_prices[product.id] = product.unit_price
+            if product.inventory < quantities[product.id]:
+                out_of_stock.append(product.id)
+        if out_of_stock:
+            raise serializers.ValidationError({'cart_id': [f"Not enough inventory for products {out_of_stock}"]})
 
-            OrderItem.objects.bulk_create(order_items)
+        Product.objects.filter(pk__in=quantities).update(inventory=F('inventory') - Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            default=Value(0)
+        ))
 
-            Cart.objects.filter(pk=cart_id).delete()
+        order = Order.objects.create(customer_id=customer_id, idempotency_key=key)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id,
+                      unit_price=unit_prices[product_id], quantity=quantity)
+            for product_id, quantity in quantities.items()
+        ])
 
-            return order
+        Cart.objects.filter(pk=cart_id).delete()
 
+        return order
@@ -0,0 +1,83 @@
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from core.versions import bump_version
+from .cache import bump_cart_version, forget_customer_ids
+from .search import get_backend
+from .models import Product, Collection, Promotion, Cart, CartItem, Customer
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver([post_save, post_delete], sender=Promotion)
+def bump_catalog_version(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def bump_promotions_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version(Product, Promotion)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def bump_cart_item_version(sender, instance, **kwargs):
+    bump_cart_version(instance.cart_id)
+
+
+@receiver(post_delete, sender=Cart)
+def bump_deleted_cart_version(sender, instance, **kwargs):
+    bump_cart_version(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'description'} & set(update_fields):
+        return
+    get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_backend().remove(instance.pk)
+
+
+def saves_collection(update_fields):
+    return update_fields is None or bool({'collection', 'collection_id'} & set(update_fields))
+
+
+@receiver(pre_save, sender=Product)
+def load_previous_collection(sender, instance, using, update_fields=None, **kwargs):
+    # Deferred when the product was loaded, or never loaded at all: the row still has it
+    if instance.pk is not None and not hasattr(instance, '_loaded_collection_id') and saves_collection(update_fields):
+        instance._loaded_collection_id = sender._base_manager.using(using) \
+            .filter(pk=instance.pk).values_list('collection_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, update_fields=None, **kwargs):
+    if not saves_collection(update_fields):
+        return
+    previous = getattr(instance, '_loaded_collection_id', None)
+    if created:
+        Collection.objects.adjust_products_count({instance.collection_id: 1})
+    elif previous is not None and previous != instance.collection_id:
+        Collection.objects.adjust_products_count({previous: -1, instance.collection_id: 1})
+    instance._loaded_collection_id = instance.collection_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    Collection.objects.adjust_products_count({instance.collection_id: -1})
+
+
+@receiver(post_save, sender=Customer)
+def forget_moved_customer(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_user_id', None)
+    if previous is not None and previous != instance.user_id:
+        forget_customer_ids(previous)
+    instance._loaded_user_id = instance.user_id
+
+
+@receiver(post_delete, sender=Customer)
+def forget_deleted_customer(sender, instance, **kwargs):
+    forget_customer_ids(instance.user_id)
@@ -1,3 +1,733 @@
-from django.test import TestCase
+import csv
+import json
+import time
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from threading import Thread
+from uuid import uuid4
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+from core.models import User
+from core.versions import VERSION_KEY, get_named_versions
+from . import export
+from .cache import cart_version_name, stats
+from .fast_serializers import FastOrderSerializer, FastProductSerializer
+from .maintenance import get_cart_cutoff, purge_carts
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product
+from .pagination import KeysetPagination
+from .serializers import CreateOrderSerializer, OrderSerializer, ProductSerializer
 
 # Create your tests here.
+
+
+def create_products(count, collection=None):
+    collection = collection or Collection.objects.create(title='Collection')
+    return Product.objects.bulk_create([
+        Product(title=f'Product {i}', slug=f'product-{i}', unit_price=Decimal('1.99') + i,
+                inventory=100, collection=collection)
+        for i in range(count)
+    ])
+
+
+class CartQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_cart(self, size):
+        cart = Cart.objects.create()
+        products = create_products(size)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=i % 3 + 1)
+            for i, product in enumerate(products)
+        ])
+        expected = sum(item.quantity * item.product.unit_price
+                       for item in CartItem.objects.filter(cart=cart).select_related('product'))
+        return cart, expected
+
+    def test_cart_retrieve_runs_a_fixed_number_of_queries(self):
+        for size in [1, 10, 100]:
+            cart, expected = self.create_cart(size)
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/store/carts/{cart.id}/')
+            self.assertEqual(len(response.data['items']), size)
+            self.assertEqual(response.data['total_price'], expected)
+
+    def test_cart_items_run_a_single_query(self):
+        for size in [1, 10, 100]:
+            cart, _ = self.create_cart(size)
+            with self.assertNumQueries(1):
+                response = self.client.get(f'/store/carts/{cart.id}/items/')
+            self.assertEqual(len(response.data), size)
+
+            item = response.data[0]
+            with self.assertNumQueries(1):
+                response = self.client.get(f'/store/carts/{cart.id}/items/{item["id"]}/')
+            self.assertEqual(response.data, item)
+            self.assertEqual(item['total_price'], item['product']['unit_price'] * item['quantity'])
+
+    def test_empty_cart_total_is_zero(self):
+        cart = Cart.objects.create()
+        response = self.client.get(f'/store/carts/{cart.id}/')
+        self.assertEqual(response.data['total_price'], 0)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        products = create_products(25)
+        # Few distinct prices, so pages break in the middle of equal values
+        for i, product in enumerate(products):
+            product.unit_price = Decimal(5 + i % 3)
+        Product.objects.bulk_update(products, ['unit_price'])
+        self.expected = list(Product.objects.order_by('-unit_price', 'pk').values_list('pk', flat=True))
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            url = response.data[link]
+        return pages, response
+
+    def test_next_and_previous_cover_every_row_once(self):
+        pages, last = self.walk('/store/products/?ordering=-unit_price', 'next')
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        backwards, first = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(backwards, pages[-2::-1])
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        self.assertEqual([product['id'] for product in second.data['results']], pages[1])
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        tampered = urlsafe_b64encode(b'{"p":["x","y"]}').decode()
+        for cursor in ['garbage', urlsafe_b64encode(b'{"p":[1]}').decode(), tampered]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/store/products/', {'ordering': '-unit_price', 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'cursor': ['Invalid cursor']})
+
+
+class CachedResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.products = create_products(3)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeated_requests_are_served_from_the_cache(self):
+        url = f'/store/products/{self.products[0].pk}/'
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['title'], 'Product 0')
+        # Other query strings are other entries
+        self.assertEqual(self.get(url + '?include=tags')['X-Cache'], 'MISS')
+        self.assertEqual(stats(), {'hits': 1, 'misses': 2})
+
+    def test_saving_invalidates(self):
+        self.get('/store/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].title = 'Renamed'
+            self.products[0].save()
+        response = self.get('/store/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [product['title'] for product in response.data['results']])
+
+    def test_deleting_invalidates(self):
+        self.get('/store/collections/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Collection.objects.create(title='Empty').delete()
+            self.products[2].delete()
+        response = self.get('/store/collections/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([collection['products_count'] for collection in response.data], [2])
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.get('/store/products/')
+        self.client.force_authenticate(User.objects.create(username='customer', email='customer@example.com'))
+        response = self.get('/store/products/')
+        self.assertNotIn('X-Cache', response)
+        self.assertIn('ETag', response)
+        self.assertEqual(stats(), {'hits': 0, 'misses': 1})
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title='Clothes')
+        for title in ['Red shirt', 'Red hat', 'Blue shirt']:
+            Product.objects.create(title=title, slug='product', unit_price=Decimal('1.99'), inventory=1,
+                                   collection=self.collection)
+
+    def search(self, query):
+        response = self.client.get('/store/products/', {'search': query})
+        return sorted(product['title'] for product in response.data['results'])
+
+    def test_every_term_has_to_match(self):
+        self.assertEqual(self.search('red shirt'), ['Red shirt'])
+        self.assertEqual(self.search('re sh'), ['Red shirt'])
+        self.assertEqual(self.search('shirt'), ['Blue shirt', 'Red shirt'])
+        self.assertEqual(self.search('red sock'), [])
+
+    def test_queryset_update_reindexes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(title='Red hat').update(title='Green cap')
+        self.assertEqual(self.search('hat'), [])
+        self.assertEqual(self.search('green cap'), ['Green cap'])
+
+    def test_bulk_create_and_bulk_update_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            sock, = Product.objects.bulk_create([
+                Product(title='Red sock', slug='sock', unit_price=Decimal('1.99'), inventory=1, collection=self.collection)
+            ])
+        self.assertEqual(self.search('red sock'), ['Red sock'])
+
+        sock.title = 'Wool sock'
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_update([sock], ['title'])
+        self.assertEqual(self.search('red sock'), [])
+        self.assertEqual(self.search('wool'), ['Wool sock'])
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.products = create_products(12)
+        self.collection = self.products[0].collection
+
+    def assertSameBody(self, path, params=None):
+        expected = self.client.get(f'/store/{path}', params)
+        response = self.client.get(f'/store/async/{path}', params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        # Pagination links point back at the view that was asked
+        self.assertEqual(response.content.replace(b'/store/async/', b'/store/'), expected.content)
+
+    def test_product_bodies_match_the_sync_views(self):
+        for params in [{}, {'ordering': '-unit_price'}, {'page': 2}, {'count': 'exact'},
+                       {'search': 'product'}, {'include': 'tags'}, {'unit_price__gt': 5}]:
+            with self.subTest(params=params):
+                self.assertSameBody('products/', params)
+        self.assertSameBody(f'products/{self.products[0].pk}/')
+        self.assertSameBody(f'products/{self.products[-1].pk + 1}/')
+
+    def test_collection_bodies_match_the_sync_views(self):
+        Collection.objects.create(title='Empty')
+        self.assertSameBody('collections/')
+        self.assertSameBody(f'collections/{self.collection.pk}/')
+        self.assertSameBody('collections/0/')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        self.product = create_products(1)[0]
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.url = f'/store/carts/{self.cart.id}/'
+
+    def test_matching_etag_gets_a_304_without_queries(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_saving_changes_the_etag(self):
+        first = self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.unit_price = Decimal('5.00')
+            self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.data['total_price'], Decimal('5.00'))
+
+    def test_change_in_the_same_second_is_not_hidden_by_if_modified_since(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.unit_price = Decimal('5.00')
+            self.product.save()
+        # Any date a client could have been sent for the first response
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(response.data['total_price'], Decimal('5.00'))
+
+
+class AddCartItemTests(TransactionTestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product = create_products(1)[0]
+
+    def add(self, quantity, product_id=None):
+        return APIClient().post(f'/store/carts/{self.cart.id}/items/', {
+            'product_id': product_id or self.product.id,
+            'quantity': quantity,
+        })
+
+    def test_add_inserts_then_increments(self):
+        response = self.add(2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 2)
+
+        response = self.add(3)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 5)
+
+    def test_add_unknown_product(self):
+        response = self.add(1, product_id=self.product.id + 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data)
+        self.assertFalse(CartItem.objects.exists())
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_concurrent_adds_lose_no_updates(self):
+        threads, adds = 8, 10
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(adds):
+                    CartItem.objects.add(self.cart.id, self.product.id, 1)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, threads * adds)
+
+
+class BulkCartItemTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        self.products = create_products(3)
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+
+    def bulk(self, entries, cart_id=None):
+        return self.client.post(f'/store/carts/{cart_id or self.cart.id}/items/bulk/', [
+            {'product_id': product_id, 'quantity': quantity} for product_id, quantity in entries
+        ], format='json')
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_updates_existing_and_creates_missing_items(self):
+        response = self.bulk([(self.products[0].id, 4), (self.products[1].id, 2)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {self.products[0].id: 4, self.products[1].id: 2})
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertEqual(response.data['total_price'],
+                         self.products[0].unit_price * 4 + self.products[1].unit_price * 2)
+
+    def test_duplicate_product_ids_are_rejected(self):
+        response = self.bulk([(self.products[1].id, 1), (self.products[1].id, 2)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {self.products[0].id: 1})
+
+    def test_unknown_product_ids_are_rejected(self):
+        unknown = self.products[-1].id + 1
+        response = self.bulk([(self.products[1].id, 1), (unknown, 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(unknown), str(response.data))
+        self.assertEqual(self.quantities(), {self.products[0].id: 1})
+
+    def test_missing_cart(self):
+        response = self.bulk([(self.products[1].id, 1)], cart_id=uuid4())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+
+class OrderQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='customer', email='customer@example.com')
+        self.customer = Customer.objects.create(user=self.user)
+        # The user -> customer id mapping is cached after the first request
+        self.assertEqual(Customer.objects.id_for_user(self.user.id), self.customer.id)
+        self.products = create_products(5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(customer=self.customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, unit_price=product.unit_price, quantity=1)
+                for product in self.products
+            ])
+
+    def test_order_list_runs_a_fixed_number_of_queries(self):
+        for count in [1, 5, 10]:
+            self.create_orders(count)
+            # orders, items with their products
+            with self.assertNumQueries(2):
+                response = self.client.get('/store/orders/')
+            self.assertEqual(len(response.data['results']), min(Order.objects.count(), KeysetPagination.page_size))
+            self.assertEqual(len(response.data['results'][0]['items']), len(self.products))
+
+    def test_order_detail_runs_a_fixed_number_of_queries(self):
+        self.create_orders(1)
+        order = Order.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/store/orders/{order.id}/')
+        self.assertEqual(len(response.data['items']), len(self.products))
+
+    def test_order_create_response_runs_a_fixed_number_of_queries(self):
+        queries = []
+        for size in [1, 5]:
+            cart = Cart.objects.create()
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=1) for product in self.products[:size]
+            ])
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post('/store/orders/', {'cart_id': cart.id})
+            self.assertEqual(len(response.data['items']), size)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='customer', email='customer@example.com')
+        self.customer = Customer.objects.create(user=self.user)
+        self.products = create_products(2)
+        Product.objects.filter(pk__in=[product.pk for product in self.products]).update(inventory=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_cart(self, quantities):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity)
+            for product, quantity in zip(self.products, quantities)
+        ])
+        return cart
+
+    def inventory(self):
+        return list(Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by('pk').values_list('inventory', flat=True))
+
+    def test_checkout_decrements_inventory(self):
+        cart = self.create_cart([2, 5])
+        response = self.client.post('/store/orders/', {'cart_id': cart.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.inventory(), [3, 0])
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_not_enough_inventory_leaves_stock_and_cart_alone(self):
+        cart = self.create_cart([2, 6])
+        response = self.client.post('/store/orders/', {'cart_id': cart.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Not enough inventory', response.data['cart_id'][0])
+        self.assertEqual(self.inventory(), [5, 5])
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_repeated_key_returns_the_same_order(self):
+        cart = self.create_cart([1, 1])
+        first = self.client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='abc')
+        second = self.client.post('/store/orders/', {'cart_id': cart.id}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.inventory(), [4, 4])
+
+    def test_retry_that_waited_on_the_cart_gets_the_placed_order(self):
+        # What a concurrent retry sees once it gets the lock: the cart is gone, the order exists
+        order = Order.objects.create(customer=self.customer, idempotency_key='abc')
+        serializer = CreateOrderSerializer()
+        self.assertEqual(serializer.place_order(self.customer.id, uuid4(), 'abc'), order)
+
+
+class AdminChangeListQueryCountTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def create_orders(self, count):
+        products = create_products(count)
+        for i, product in enumerate(products):
+            user = User.objects.create(username=f'user-{i}', email=f'user-{i}@example.com',
+                                       first_name=f'First{i}', last_name=f'Last{i}')
+            order = Order.objects.create(customer=Customer.objects.create(user=user))
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.unit_price)
+
+    def test_changelists_run_a_fixed_number_of_queries(self):
+        self.create_orders(30)
+        ContentType.objects.get_for_model(Product)
+        # session, user, count and rows, plus the collection filter choices and tags for products
+        for url, queries in [
+            ('/admin/store/product/', 6),
+            ('/admin/store/order/', 4),
+            ('/admin/store/customer/', 4),
+            ('/admin/store/collection/', 4),
+        ]:
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_order_changelist_joins_customer_and_user(self):
+        self.create_orders(3)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/admin/store/order/')
+        rows = context.captured_queries[-1]['sql']
+        self.assertIn('store_customer', rows)
+        self.assertIn('core_user', rows)
+
+    def test_customer_search_matches_user_names(self):
+        self.create_orders(3)
+        response = self.client.get('/admin/store/customer/', {'q': 'First1'})
+        self.assertEqual([customer.user.first_name for customer in response.context['cl'].result_list], ['First1'])
+
+    def test_collection_filter_is_capped(self):
+        collections = [Collection.objects.create(title=f'Collection {i:03}') for i in range(120)]
+        response = self.client.get('/admin/store/product/', {'collection__id__exact': collections[-1].id})
+        spec = next(spec for spec in response.context['cl'].filter_specs if spec.field_path == 'collection')
+        self.assertEqual(len(spec.lookup_choices), 101)
+        self.assertIn((collections[-1].id, 'Collection 119'), spec.lookup_choices)
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = create_products(12)
+        Product.objects.filter(pk=self.products[0].pk).update(description='First')
+        user = User.objects.create(username='customer', email='customer@example.com')
+        customer = Customer.objects.create(user=user)
+        for _ in range(3):
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, unit_price=product.unit_price, quantity=2)
+                for product in self.products[:4]
+            ])
+        Order.objects.create(customer=customer)
+
+    def render(self, data):
+        return api_settings.DEFAULT_RENDERER_CLASSES[0]().render(data)
+
+    def assertRendersAlike(self, serializer_class, fast_class, queryset):
+        expected = self.render(serializer_class(queryset, many=True).data)
+        fast = fast_class()
+        self.assertEqual(self.render(fast.serialize(fast.values(queryset))), expected)
+
+    def test_products_match_the_regular_serializer(self):
+        self.assertRendersAlike(ProductSerializer, FastProductSerializer, Product.objects.order_by('-unit_price'))
+
+    def test_price_with_tax_is_exact(self):
+        # With a float 1.1 these would carry binary noise past the third place
+        queryset = Product.objects.filter(pk__in=[product.pk for product in self.products[:2]]).order_by('pk')
+        fast = FastProductSerializer()
+        for data in [ProductSerializer(queryset, many=True).data, fast.serialize(fast.values(queryset))]:
+            self.assertEqual([str(product['price_with_tax']) for product in data], ['2.189', '3.289'])
+
+    def test_orders_match_the_regular_serializer(self):
+        self.assertRendersAlike(OrderSerializer, FastOrderSerializer, Order.objects.with_items().order_by('pk'))
+
+    def test_product_list_pages_match(self):
+        client = APIClient()
+        for params in [{}, {'ordering': '-unit_price'}, {'page': 2}]:
+            response = client.get('/store/products/', params)
+            products = Product.objects.order_by(*(params.get('ordering', 'title'), 'pk'))
+            if 'page' in params:
+                products = products[10:20]
+            else:
+                products = products[:10]
+            self.assertEqual(response.content, self.render({
+                **{key: value for key, value in response.data.items() if key != 'results'},
+                'results': ProductSerializer(products, many=True).data,
+            }))
+
+    def test_included_fields_use_the_regular_serializer(self):
+        self.assertFalse(FastProductSerializer.supports(Request(RequestFactory().get('/', {'include': 'tags'}))))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.products = create_products(5)
+        user = User.objects.create(username='customer', email='customer@example.com')
+        customer = Customer.objects.create(user=user)
+        self.orders = [Order.objects.create(customer=customer, payment_status=status) for status in 'PC']
+        for order in self.orders:
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, unit_price=product.unit_price, quantity=2)
+                for product in self.products[:3]
+            ])
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', email='admin@example.com', is_staff=True))
+
+    def test_products_stream_as_csv(self):
+        response = self.client.get('/store/export/products/', {'output': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], [column for column, _ in export.PRODUCT_FIELDS])
+        self.assertEqual([row[:4] for row in rows[1:]], [
+            [str(product.pk), product.title, product.slug, str(product.unit_price)] for product in self.products
+        ])
+
+    def test_orders_stream_as_ndjson_in_chunks(self):
+        _, chunks = export.export('orders', status='C', chunk_size=2)
+        chunks = list(chunks)
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [2, 1])
+        rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual({row['order_id'] for row in rows}, {self.orders[1].pk})
+        self.assertEqual(rows[0]['unit_price'], str(self.products[0].unit_price))
+
+    def test_invalid_arguments_are_rejected(self):
+        for params in [{'output': 'xml'}, {'since': 'yesterday'}, {'status': 'X'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/store/export/orders/', params).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get('/store/export/orders/').status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/store/export/orders/').status_code, 401)
+
+    def test_command_writes_the_same_rows(self):
+        out = StringIO()
+        call_command('export_data', 'orders', '--output', 'csv', '--chunk-size', '4', stdout=out)
+        response = self.client.get('/store/export/orders/', {'output': 'csv'})
+        self.assertEqual(out.getvalue(), b''.join(response.streaming_content).decode())
+        self.assertEqual(len(out.getvalue().splitlines()), 7)
+
+
+class PurgeCartsTests(TestCase):
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.old = [self.create_cart(days=40) for _ in range(5)]
+        self.recent = self.create_cart(days=1)
+
+    def create_cart(self, days):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        Cart.objects.filter(pk=cart.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return cart
+
+    def test_purges_expired_carts_in_batches(self):
+        batches = []
+        with self.captureOnCommitCallbacks(execute=True):
+            progress = purge_carts(get_cart_cutoff(30), batch_size=2, progress=batches.append)
+        self.assertEqual((progress.batches, progress.carts, progress.items), (3, 5, 5))
+        self.assertEqual([batch.carts for batch in batches], [2, 4, 5])
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertEqual(CartItem.objects.get().cart_id, self.recent.pk)
+
+    def test_limit_stops_early(self):
+        progress = purge_carts(get_cart_cutoff(30), batch_size=2, limit=3)
+        self.assertEqual(progress.carts, 3)
+        self.assertEqual(Cart.objects.count(), 3)
+
+    def test_purged_carts_get_new_versions(self):
+        version = get_named_versions([cart_version_name(self.old[0].pk)])[0]
+        time.sleep(0.002)
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_carts(get_cart_cutoff(30))
+        # Dropped rather than left bumped by the delete signals
+        self.assertIsNone(cache.get(VERSION_KEY.format(cart_version_name(self.old[0].pk))))
+        self.assertNotEqual(get_named_versions([cart_version_name(self.old[0].pk)])[0], version)
+
+    def test_dry_run_deletes_nothing(self):
+        out = StringIO()
+        call_command('purge_carts', '--dry-run', stdout=out)
+        self.assertIn('5 carts with 5 items', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 6)
+
+
+class ReconcileCollectionCountsTests(TestCase):
+    def test_drifted_counts_are_recomputed(self):
+        full = Collection.objects.create(title='Full')
+        create_products(3, full)
+        empty = Collection.objects.create(title='Empty')
+        Collection.objects.filter(pk=full.pk).update(products_count=7)
+        Collection.objects.filter(pk=empty.pk).update(products_count=2)
+
+        with CaptureQueriesContext(connection) as context:
+            call_command('reconcile_collection_counts', stdout=StringIO())
+
+        self.assertEqual(dict(Collection.objects.values_list('title', 'products_count')), {'Full': 3, 'Empty': 0})
+        updates = [query['sql'] for query in context if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        for sql in updates:
+            # MySQL rejects subqueries that read the table being updated
+            self.assertNotIn('FROM "store_collection"', sql)
+
+
+class ProductsCountTests(TestCase):
+    def setUp(self):
+        self.old = Collection.objects.create(title='Old')
+        self.new = Collection.objects.create(title='New')
+
+    def assertCounts(self, old, new):
+        self.assertEqual(dict(Collection.objects.values_list('title', 'products_count')), {'Old': old, 'New': new})
+
+    def test_create_and_delete(self):
+        product = Product.objects.create(title='Product', slug='product', unit_price=Decimal('1.99'),
+                                         inventory=1, collection=self.old)
+        self.assertCounts(1, 0)
+        product.delete()
+        self.assertCounts(0, 0)
+
+    def test_bulk_create_and_queryset_delete(self):
+        create_products(3, self.old)
+        create_products(2, self.new)
+        self.assertCounts(3, 2)
+        Product.objects.filter(collection=self.old).delete()
+        self.assertCounts(0, 2)
+
+    def test_move_via_save(self):
+        product = create_products(1, self.old)[0]
+        product.collection = self.new
+        product.save()
+        self.assertCounts(0, 1)
+
+    def test_move_via_save_after_deferring_the_collection(self):
+        create_products(2, self.old)
+        for queryset in [Product.objects.only('title'), Product.objects.defer('collection')]:
+            product = queryset.filter(collection=self.old).first()
+            product.collection = self.new
+            product.save()
+        self.assertCounts(0, 2)
+
+    def test_saving_other_fields_of_a_deferred_product_keeps_the_counts(self):
+        create_products(1, self.old)
+        product = Product.objects.only('title').get()
+        product.title = 'Renamed'
+        product.save()
+        self.assertCounts(1, 0)
+
+    def test_move_via_update(self):
+        create_products(3, self.old)
+        Product.objects.filter(title__in=['Product 0', 'Product 1']).update(collection=self.new)
+        self.assertCounts(1, 2)
@@ -1,6 +1,6 @@
 from django.urls import include, path
 from rest_framework_nested import routers
-from . import views
+from . import views, async_views
 from pprint import pprint
 
 router = routers.DefaultRouter()
@@ -15,6 +15,20 @@ products_router.register('reviews', views.ReviewViewSet, basename='product-revie
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup = 'cart')
 carts_router.register('items', views.CartItemViewSet, basename = 'cart-items')
 
+async_urlpatterns = [
+    path('async/products/', async_views.product_list),
+    path('async/products/<int:pk>/', async_views.product_detail),
+    path('async/products/<int:product_pk>/reviews/', async_views.review_list),
+    path('async/products/<int:product_pk>/reviews/<int:pk>/', async_views.review_detail),
+    path('async/collections/', async_views.collection_list),
+    path('async/collections/<int:pk>/', async_views.collection_detail),
+]
+
+export_urlpatterns = [
+    path('export/orders/', views.ExportView.as_view(kind='orders')),
+    path('export/products/', views.ExportView.as_view(kind='products')),
+]
+
 # URLConf
-urlpatterns = router.urls + products_router.urls + carts_router.urls
+urlpatterns = router.urls + products_router.urls + carts_router.urls + async_urlpatterns + export_urlpatterns
 
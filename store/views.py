@@ -1,50 +1,70 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, UpdateModelMixin
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.views import APIView
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser, DjangoModelPermissions
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer, Order
-from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, CreateOrderSerializer, UpdateOrderSerializer
+from .models import Product, Collection, Promotion, OrderItem, Review, Cart, CartItem, Customer, Order
+from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, BulkCartItemEntrySerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, CreateOrderSerializer, UpdateOrderSerializer
 from .filters import ProductFilter
-from .pagination import DefaultPagination
+from .pagination import KeysetPagination
 from .permissions import IsAdminOrReadOnly, ViewCustomerHistoryPermission
+from .cache import CachedResponseMixin, ConditionalGetMixin, cart_version_name
+from .fast_serializers import FastListMixin, FastOrderSerializer, FastProductSerializer
+from .search import ProductSearchFilter
+from . import export
 from pprint import pprint
 # Create your views here.
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CachedResponseMixin, FastListMixin, ModelViewSet):
+    # Safe requests may read from a replica, see core.db.ReplicaMiddleware
+    read_from_replica = True
+    cache_models = [Product, Promotion]
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    fast_serializer_class = FastProductSerializer
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
-    search_fields = ['title', 'description']
+    pagination_class = KeysetPagination
     ordering_fields = ["unit_price", "last_update"]
     permission_classes = [IsAdminOrReadOnly]
     def get_serializer_context(self):
         return {"request" : self.request}
+
+    def get_cache_models(self):
+        # Fields added with ?include= can depend on other models
+        models = super().get_cache_models()
+        for name in ProductSerializer.get_included(self.request):
+            models += ProductSerializer.optional_fields[name].models
+        return models
     
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error' : 'Product cannot be deleted because its associated with an order item'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
     
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count = Count('products')).all()
+class CollectionViewSet(CachedResponseMixin, ModelViewSet):
+    read_from_replica = True
+    cache_models = [Collection, Product]
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
 
     def destroy(self, request, *args, **kwargs):
-        collection = get_object_or_404(Collection.objects.annotate(products_count = Count('products')), pk = kwargs['pk'])
-        if collection.products.count() > 0:
+        collection = get_object_or_404(Collection, pk = kwargs['pk'])
+        if collection.products_count > 0:
             return Response({'error' : 'Collection cannot be deleted because its associated with products'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
 class ReviewViewSet(ModelViewSet):
+    read_from_replica = True
     serializer_class = ReviewSerializer
 
     # This is because we want to retrieve reviews for only one product
@@ -54,14 +74,24 @@ class ReviewViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
 
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+class CartViewSet(ConditionalGetMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    cache_models = [Product]
+    queryset = Cart.objects.with_items()
     serializer_class = CartSerializer
 
-class CartItemViewSet(ModelViewSet):
+    def get_version_names(self):
+        return super().get_version_names() + [cart_version_name(self.kwargs['pk'])]
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+class CartItemViewSet(ConditionalGetMixin, ModelViewSet):
+    cache_models = [Product]
     http_method_names = ['get', 'post', 'patch', 'delete']
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'bulk':
+            return BulkCartItemEntrySerializer
+        elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
@@ -70,12 +100,29 @@ class CartItemViewSet(ModelViewSet):
 
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
+
+    def get_version_names(self):
+        return super().get_version_names() + [cart_version_name(self.kwargs['cart_pk'])]
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
         
     serializer_class = CartItemSerializer
     def get_queryset(self):
         return CartItem.objects \
             .filter(cart_id=self.kwargs['cart_pk']) \
-            .select_related('product')
+            .with_total_price()
+
+    # [{ "product_id" : 1, "quantity" : 2 }, ...] sets the quantity of each product in one go
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        return Response(CartSerializer(cart).data)
 
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
@@ -99,8 +146,10 @@ class CustomerViewSet(ModelViewSet):
             serializer.save()
             return Response(serializer.data)
 
-class OrderViewSet(ModelViewSet):
-    http_method_names = ['get', 'patch', 'delete', 'head', 'options']
+class OrderViewSet(FastListMixin, ModelViewSet):
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    fast_serializer_class = FastOrderSerializer
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
@@ -108,10 +157,13 @@ class OrderViewSet(ModelViewSet):
         return [IsAuthenticated()]
 
     def create(self, request, *args, **kwargs):
-        serializer = CreateOrderSerializer(data = request.data, context={'user_id' : self.request.user.id})
+        serializer = CreateOrderSerializer(data = request.data, context={
+            'user_id' : self.request.user.id,
+            'idempotency_key' : request.headers.get('Idempotency-Key'),
+        })
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(Order.objects.with_items().get(pk=order.pk))
         return Response(serializer.data)
 
     def get_serializer_class(self):
@@ -125,10 +177,42 @@ class OrderViewSet(ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all()
+            return Order.objects.with_items()
         
-        (customer_id,created) = Customer.objects.only('id').get_or_create(user_id = user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return Order.objects.with_items().filter(customer_id=Customer.objects.id_for_user(user.id))
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    # Exports pick their content type from ?output=, errors are always JSON
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+class ExportView(APIView):
+    '''
+    Streams every matching row, e.g. /store/export/orders/?output=csv&since=2024-01-01&until=2024-02-01&status=C
+    '''
+    kind = None
+    permission_classes = [IsAdminUser]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request):
+        # ?format= is taken by DRF's renderer selection, hence ?output=
+        output = request.query_params.get('output', 'ndjson')
+        try:
+            content_type, rows = export.export(
+                self.kind, output,
+                since=request.query_params.get('since'),
+                until=request.query_params.get('until'),
+                status=request.query_params.get('status'),
+            )
+        except ValueError as error:
+            raise ValidationError({'detail': str(error)})
+        response = StreamingHttpResponse(rows, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.kind}.{output}"'
+        return response
 
 
 '''
@@ -187,7 +271,7 @@ def collection_detail(request, pk):
 @api_view(['GET','POST'])
 def collection_list(request):
     if request.method == 'GET':
-        queryset = Collection.objects.annotate(products_count = Count('products')).all()
+        queryset = Collection.objects.all()
         serializer = CollectionSerializer(queryset, many=True)
         return Response(serializer.data)
     
@@ -50,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
+    'core.db.ReplicaMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -100,6 +103,45 @@ DATABASES = {
     }
 }
 
+# Catalog reads go to these aliases of DATABASES, replicas of `default`.
+# Give each one 'TEST': {'MIRROR': 'default'} so tests don't need them.
+REPLICA_DATABASES = []
+# How long a client that wrote something keeps reading from the primary
+REPLICA_STICKY_SECONDS = 5
+
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+STORE_RESPONSE_CACHE_TIMEOUT = 60 * 15
+
+STORE_SEARCH_BACKEND = 'store.search.InvertedIndexBackend'
+
+# Carts older than this are deleted by the purge_carts command
+STORE_CART_EXPIRY_DAYS = 30
+
+# Models that can be liked through /likes/, with the serializer the most
+# liked listing shows them with (None to list ids and counts only)
+LIKES_MODELS = {
+    'store.product': 'store.serializers.ProductSerializer',
+}
+
+
+# Fraction of requests profiled by core.profiling.ProfilingMiddleware, and a
+# secret that forces profiling when sent in the X-Profile header
+PROFILING_SAMPLE_RATE = 0
+PROFILING_HEADER_TOKEN = None
+PROFILING_BUFFER_SIZE = 50
+
+# Directory where every worker process writes its request metrics so
+# /metrics/ can add them up, None keeps them in the serving process only
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 10
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -147,7 +189,17 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING' : False,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        'core.authentication.CachedJWTAuthentication'
+    ],
+    # Decimals are rendered and parsed exactly, faster with msgspec installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
 }
 
@@ -158,6 +210,11 @@ SIMPLE_JWT = {
 
 AUTH_USER_MODEL = 'core.user'
 
+AUTHENTICATION_BACKENDS = ['core.authentication.CachedModelBackend']
+
+# How long authenticated users and their permission sets stay cached
+AUTH_CACHE_TIMEOUT = 60 * 5
+
 DJOSER = {
     'SERIALIZERS' : {
         'user_create' : 'core.serializers.UserCreateSerializer',
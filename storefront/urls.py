@@ -16,14 +16,18 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 import debug_toolbar
+from core.views import metrics
 
 admin.site.site_header = "Storefront Admin"
 admin.site.index_title = "Admin"
 urlpatterns = [
+    path('admin/profiles/', include('core.urls')),
     path('admin/', admin.site.urls),
     path('playground/', include('playground.urls')),
     path('store/', include('store.urls')),
+    path('likes/', include('likes.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
+    path('metrics/', metrics),
     path('__debug__/', include(debug_toolbar.urls)),
 ]
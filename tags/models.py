@@ -1,4 +1,6 @@
+from collections import defaultdict
 from django.db import models
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
@@ -14,6 +16,35 @@ class TaggedItemManager(models.Manager):
                 object_id=obj_id
             )
 
+    def get_tags_for_many(self, obj_type, obj_ids):
+        '''
+        Returns {object_id: [tags]} for every object that has tags, in one
+        query.
+        '''
+        tags = self.get_tags_for_objects([(obj_type, obj_ids)])
+        return {obj_id: object_tags for (_, obj_id), object_tags in tags.items()}
+
+    def get_tags_for_objects(self, objects):
+        '''
+        Takes (model, ids) pairs and returns {(model, id): [tags]} for all
+        of them in one query. Content types come from get_for_model(), which
+        caches them for the life of the process.
+        '''
+        condition = Q()
+        models_by_content_type = {}
+        for obj_type, obj_ids in objects:
+            content_type = ContentType.objects.get_for_model(obj_type)
+            models_by_content_type[content_type.id] = obj_type
+            condition |= Q(content_type=content_type, object_id__in=list(obj_ids))
+        if not condition:
+            return {}
+
+        tags = defaultdict(list)
+        items = self.select_related('tag').filter(condition).order_by('tag__label', 'tag_id')
+        for item in items:
+            tags[(models_by_content_type[item.content_type_id], item.object_id)].append(item.tag)
+        return dict(tags)
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=255)
@@ -28,3 +59,8 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]